@@ -2,57 +2,118 @@
 # Program: GUI extension for Sudoku project
 
 
+import argparse
 import pygame
+import prefetch
+import rating
 import sudoku
+import functools
+import math
 import time
-import sys
 import random
 import os
+import threading
 
-pygame.font.init()
-pygame.mixer.init()
+STARTED = time.perf_counter()                   # Import time, for timing start up with --startup
+FPS = 60                                        # Default frame rate cap while the board is animating
+TICK = pygame.USEREVENT                         # Posted once a second to update the clock
+SONG_ENDED = pygame.USEREVENT + 1               # Posted by the music channel when a song finishes
+MUSIC = 'Music'                                 # Folder of songs to play
+FONTS = {}                                      # (name, size) -> loaded font
+GLYPHS = {}                                     # (text, colour, font name, size) -> rendered surface
+POOLS = {}                                      # Box size -> games prepared in the background
+SIZES = (2, 3, 4, 5)                            # Box sizes offered on the menu: 4x4, 9x9, 16x16 and 25x25
 
 
 class Grid:
-    def __init__(self, rows, cols, width, height, diff):
+    __slots__ = ('solved', 'board', 'rows', 'cols', 'width', 'height', 'selected', 'squares', 'background', 'status',
+                 'redraw', 'unsolved', 'position', 'used', 'candidates', 'pencil', 'shape', 'id')
+
+    def __init__(self, rows, cols, width, height, diff, stats=None):
         """
-        Contains all of the methods and parameters pertaining to the Sudoku board itself.
+        Contains all of the methods and parameters pertaining to the Sudoku board itself. The board and solution are
+        sudoku.PackedBoard objects, indexed board[row][col] like nested lists. rows (equal to cols) picks the board
+        size: 4, 9, 16 or 25. A sudoku.SolveStats times taking the game from the pool ('load') and building the
+        squares and pencil marks ('setup'); prefetch.make_puzzle times the phases of preparing a game.
         """
-        game = sudoku.Board(diff)       # Initializes a random game given difficulty
-        game.difficulty()
-        game.shuffle_board()
-        game.solve()
-        self.solved = game.solved       # Solver solution to compare against users input
-        self.board = game.board         # Current state of board
+        box = math.isqrt(rows)
+        if stats is not None:
+            with stats.phase('load'):
+                puzzle, solution, board_id = puzzle_pool(box).get(diff)
+        else:
+            puzzle, solution, board_id = puzzle_pool(box).get(diff)     # A prepared game of the given difficulty
+        start = time.perf_counter()
+        self.solved = sudoku.PackedBoard(solution)      # Solver solution to compare against users input
+        self.board = sudoku.PackedBoard(puzzle)         # Current state of board
+        self.shape = sudoku.geometry(box)               # Units and peers for this board size
+        self.id = board_id                              # Rebuilds this game with sudoku.Board.from_id
         self.rows = rows
         self.cols = cols
         self.width = width              # Window width and height
         self.height = height
         self.selected = None            # Current board selection
         self.squares = []               # Squares within board
+        self.background = None          # Window with only the grid lines drawn, built on first draw
+        self.status = None              # Time and music state last drawn in the bottom bar
+        self.redraw = True              # Repaint the whole window on the next draw
+        self.unsolved = []              # Empty cells (row * 9 + col), in no particular order
+        self.position = {}              # Cell -> its index in self.unsolved
+        self.used = sudoku.unit_masks(self.board.cells)     # Digits placed in each row, column and box
+        self.candidates = [0] * self.shape.cells        # Digits still possible in each empty cell
+        self.pencil = False             # Show candidates as pencil marks
         for row in range(rows):         # Creates square objects
             rw = []
             for col in range(cols):
-                sq = Square(game.board[row][col], row, col, width, height)
+                sq = Square(self.board[row][col], row, col, width, height, rows)
                 rw.append(sq)
             self.squares.append(rw)
+        for cell in range(self.shape.cells):
+            if not self.board.cells[cell]:
+                self.mark_unsolved(cell)
+            self.update_candidates(cell)
+        if stats is not None:
+            stats.phases['setup'] = time.perf_counter() - start
 
     def draw(self, win):
         """
-        Draws the board itself, with board lines and square numbers.
+        Draws the board itself, with board lines and square numbers. The lines are drawn once into a cached
+        background, and after the first frame only squares that changed are repainted. Returns the list of
+        rectangles that changed so only those need to be sent to the display.
+        """
+        if self.background is None:
+            self.background = self.draw_background(win.get_size())
+            load_glyphs(self.width, self.rows)
+        if self.redraw:                                     # Start from a clean board
+            win.blit(self.background, (0, 0))
+            self.status = None
+            self.redraw = False
+            for row in range(self.rows):
+                for col in range(self.cols):
+                    self.squares[row][col].draw(win, self.background)
+            return [win.get_rect()]
+
+        rects = []
+        for row in range(self.rows):
+            for col in range(self.cols):
+                if self.squares[row][col].dirty:
+                    rects.append(self.squares[row][col].draw(win, self.background))
+        return rects
+
+    def draw_background(self, size):
+        """
+        Renders the white window with the board lines, used to erase squares before they are redrawn.
         """
-        gap = self.width / 9
+        background = pygame.Surface(size)
+        background.fill('white')
+        gap = self.width / self.rows
         for num in range(self.rows + 1):
-            if num % 3 == 0 and num != 0:
+            if num % self.shape.box == 0 and num != 0:
                 thickness = 4
             else:
                 thickness = 1
-            pygame.draw.line(win, (0, 0, 0), (0, num * gap), (self.width, num * gap), thickness)
-            pygame.draw.line(win, (0, 0, 0), (num * gap, 0), (num * gap, self.height), thickness)
-
-        for row in range(self.rows):
-            for col in range(self.cols):
-                self.squares[row][col].draw(win)
+            pygame.draw.line(background, (0, 0, 0), (0, num * gap), (self.width, num * gap), thickness)
+            pygame.draw.line(background, (0, 0, 0), (num * gap, 0), (num * gap, self.height), thickness)
+        return background
 
     def place(self, val):
         """
@@ -61,8 +122,7 @@ class Grid:
         """
         row, col = self.selected
         if self.solved[row][col] == val:        # If guess matches solved board, place into board
-            self.squares[row][col].set(val)
-            self.board[row][col] = val
+            self.set_value(row, col, val)
             return True
         else:                                   # Change temp back to empty
             self.squares[row][col].set(0)
@@ -74,7 +134,7 @@ class Grid:
         Gets the exact square on board of click in Grid.
         """
         if pos[0] < self.width and pos[1] < self.height:
-            gap = self.width / 9
+            gap = self.width / self.rows
             x = pos[0] // gap
             y = pos[1] // gap
             return int(y), int(x)
@@ -85,11 +145,13 @@ class Grid:
         """
         Updates the currently selected square from the last click.
         """
-        for row in range(self.rows):                        # Remove previous selections
-            for col in range(self.cols):
-                self.squares[row][col].selected = False
+        if self.selected:                                   # Remove previous selection
+            row, col = self.selected
+            self.squares[row][col].selected = False
+            self.squares[row][col].dirty = True
 
         self.squares[x][y].selected = True                  # Add new selection
+        self.squares[x][y].dirty = True
         self.selected = (x, y)
 
     def delete(self):
@@ -111,178 +173,495 @@ class Grid:
         """
         Checks if game is complete (no empty squares).
         """
-        for row in range(self.rows):
-            for col in range(self.cols):
-                if self.squares[row][col].value == 0:
-                    return False
-        return True
+        return not self.unsolved
 
-    def solve_visual(self, win):
+    def hint(self):
         """
-        Solver used to illustrate backtracking algorithm. The method is the same, but this is needed to have
-        the appropriate time delay and square coloring.
+        Gives user a hint by filling in the next square that can be worked out from the board as it stands, using
+        the candidates kept up to date for the pencil marks (see rating.next_step). Returns the rating.Hint, which
+        names the technique that finds it, or None if the board is complete. Only when no technique applies does
+        the hint come from the solution, which every placed number has been checked against, saving a search.
         """
-        empty = find_empty(self.board)                          # Get next empty square
-        if not empty:                                           # No empty cells so the board is solved
-            return True
-        else:
-            row, col = empty
-
-        for num in range(1, 10):                                # Attempt to insert numbers 1 - 9
-            if valid(self.board, num, (row, col)):
-                self.board[row][col] = num                      # If valid, insert number
-                self.squares[row][col].set(num)                 # Set number into board
-                self.squares[row][col].draw_solver(win, True)   # Changes color of square
-                pygame.display.update()
-                pygame.time.delay(100)
-                if self.solve_visual(win):                      # Keep trying to step forward recursively
-                    return True
-                self.board[row][col] = 0                        # If board is not valid, remove inserted number
-                self.squares[row][col].set(0)                   # Removes number
-                self.squares[row][col].draw_solver(win, False)  # Changes color to red
-
-        return False
+        if self.finished():
+            return None
+        step = rating.next_step(self.board.cells, self.candidates, self.shape, lambda cells: self.solved.cells)
+        if step is not None:
+            row, col = divmod(step.cell, self.cols)
+            self.set_value(row, col, step.digit)
+        return step
 
-    def hint(self):
+    def set_value(self, row, col, val):
         """
-        Gives user a hint by randomly filling in one square.
+        Writes a number (0 to clear it) into the board and its square, keeping the unsolved cells and the candidates
+        of the square and its peers up to date.
         """
-        if self.finished():
+        cell = row * self.cols + col
+        old = self.squares[row][col].value
+        self.board[row][col] = val
+        self.squares[row][col].set(val)
+        if old == val:
             return
-        row, col = random.randint(0, 8), random.randint(0, 8)
-        while self.board[row][col] == self.solved[row][col]:
-            row, col = random.randint(0, 8), random.randint(0, 8)
+        if old:
+            bit = 1 << (old - 1)
+            for unit in self.shape.cell_units[cell]:
+                self.used[unit] &= ~bit
+            self.mark_unsolved(cell)
+        if val:
+            bit = 1 << (val - 1)
+            for unit in self.shape.cell_units[cell]:
+                self.used[unit] |= bit
+            self.mark_solved(cell)
+        self.update_candidates(cell)
+        for peer in self.shape.peers[cell]:
+            self.update_candidates(peer)
+
+    def mark_unsolved(self, cell):
+        """
+        Adds a cell to the unsolved list.
+        """
+        if cell not in self.position:
+            self.position[cell] = len(self.unsolved)
+            self.unsolved.append(cell)
 
-        value = self.solved[row][col]
-        self.board[row][col] = value
-        self.squares[row][col].set(value)
+    def mark_solved(self, cell):
+        """
+        Removes a cell from the unsolved list by moving the last entry into its place.
+        """
+        index = self.position.pop(cell, None)
+        if index is None:
+            return
+        last = self.unsolved.pop()
+        if last != cell:
+            self.unsolved[index] = last
+            self.position[last] = index
+
+    def update_candidates(self, cell):
+        """
+        Recomputes the candidate mask of one cell from the row, column and box masks.
+        """
+        if self.board.cells[cell]:
+            mask = 0
+        else:
+            row, col, box = self.shape.cell_units[cell]
+            mask = self.shape.all_digits & ~(self.used[row] | self.used[col] | self.used[box])
+        self.candidates[cell] = mask
+        self.squares[cell // self.cols][cell % self.cols].set_marks(mask if self.pencil else 0)
+
+    def toggle_pencil(self):
+        """
+        Shows or hides the candidates of every empty square as pencil marks. 25x25 squares are too small to hold
+        them, so there the marks stay hidden.
+        """
+        self.pencil = not self.pencil and cell_fonts(self.width, self.rows)[1] is not None
+        for cell in range(self.shape.cells):
+            self.squares[cell // self.cols][cell % self.cols].set_marks(self.candidates[cell] if self.pencil else 0)
 
 
 class Square:
     """
     Contains the methods and values for each individual square on the board.
     """
-    def __init__(self, value, row, col, width, height):
+    __slots__ = ('value', 'temp', 'row', 'col', 'width', 'height', 'size', 'selected', 'dirty', 'outline', 'marks')
+
+    def __init__(self, value, row, col, width, height, size=9):
         self.value = value      # Current number value
         self.temp = 0           # Temporary value
         self.row = row          # Place on board
         self.col = col
         self.width = width
         self.height = height
+        self.size = size        # Squares per row of the board
         self.selected = False
+        self.dirty = True       # Needs to be redrawn
+        self.outline = None     # Solver visualization color, green for placed and red for backtracked
+        self.marks = 0          # Candidate bitmask shown as pencil marks
 
-    def draw(self, win):
+    def draw(self, win, background):
         """
-        Draws a number onto the window.
+        Draws a number onto the window, first restoring the square from the background. Returns the square's
+        rectangle.
         """
-        font = pygame.font.SysFont("comicsans", 40)
-        gap = self.width / 9
+        gap = self.width / self.size
         x = self.col * gap
         y = self.row * gap
+        rect = pygame.Rect(x, y, gap, gap)
+        win.blit(background, rect, rect)                                # Erase the old number and selection
+        digit_size, mark_size = cell_fonts(self.width, self.size)
 
         if self.temp != 0 and self.value == 0:
-            text = font.render(str(self.temp), True, (128, 128, 128))   # Text object of number with color and font
-            win.blit(text, (x + 5, y + 5))                              # Draw onto board
+            text = glyph(sudoku.SYMBOLS[self.temp], (128, 128, 128), "comicsans", digit_size)  # Cached rendered text
+            win.blit(text, (x + gap / 12, y + gap / 12))                # Draw onto board
         elif not (self.value == 0):
-            text = font.render(str(self.value), True, (0, 0, 0))
+            text = glyph(sudoku.SYMBOLS[self.value], (0, 0, 0), "comicsans", digit_size)
             win.blit(text, (x + (gap / 2 - text.get_width() / 2), y + (gap / 2 - text.get_height() / 2)))
-
+        elif self.marks:
+            box = math.isqrt(self.size)
+            third = gap / box
+            for digit in range(1, self.size + 1):                       # Small digits in a box x box layout
+                if self.marks & (1 << (digit - 1)):
+                    text = glyph(sudoku.SYMBOLS[digit], (128, 128, 128), "comicsans", mark_size)
+                    left = x + ((digit - 1) % box) * third + (third - text.get_width()) / 2
+                    top = y + ((digit - 1) // box) * third + (third - text.get_height()) / 2
+                    win.blit(text, (left, top))
+
+        if self.outline:
+            pygame.draw.rect(win, self.outline, (x, y, gap, gap), 3)    # Solver's last move on this square
         if self.selected:
             pygame.draw.rect(win, (255, 0, 0), (x, y, gap, gap), 3)     # If selected draw red square around
-
-    def draw_solver(self, win, state=True):
-        """
-        Draws the components to visualize the solver algorithm.
-        """
-        font = pygame.font.SysFont("comicsans", 40)
-        gap = self.width / 9
-        x = self.col * gap
-        y = self.row * gap
-
-        pygame.draw.rect(win, 'white', (x, y, gap, gap), 0)             # Draws white rectangle to cover old number
-        text = font.render(str(self.value), True, (0, 0, 0))
-        win.blit(text, (x + (gap / 2 - text.get_width() / 2), y + (gap / 2 - text.get_height() / 2)))
-        if state:
-            pygame.draw.rect(win, 'green', (x, y, gap, gap), 3)         # If square if chosen green
-        else:
-            pygame.draw.rect(win, 'red', (x, y, gap, gap), 3)           # If we backtracked then red
+        self.dirty = False
+        return rect
 
     def set(self, val):
         """
         Sets the number of a square.
         """
-        self.value = val
+        if val != self.value:
+            self.value = val
+            self.dirty = True
 
     def set_temp(self, val):
         """
         Sets the temporary number of a square.
         """
-        self.temp = val
+        if val != self.temp:
+            self.temp = val
+            self.dirty = True
 
+    def set_marks(self, marks):
+        """
+        Sets the pencil marks of a square (0 for none).
+        """
+        if marks != self.marks:
+            self.marks = marks
+            self.dirty = True
+
+    def set_outline(self, color):
+        """
+        Sets the solver visualization outline of a square (None to remove it).
+        """
+        if color != self.outline:
+            self.outline = color
+            self.dirty = True
 
-def valid(board, guess, pos):
+
+class SolverVisual:
     """
-    Checks if given insertion into board is a valid input.
+    Plays back the backtracking algorithm on the board from sudoku.backtrack_steps, a few steps per frame from the
+    main loop, so the window keeps responding while it runs. Placed numbers are outlined green and squares the
+    solver backtracked out of red. Speed is a multiple of the original 10 steps per second, up to unthrottled, where
+    steps run for most of each frame. The playback can be paused, or cancelled to take back its numbers.
     """
-    for num in range(9):                                    # Check row
-        if board[pos[0]][num] == guess and pos[1] != num:
-            return False
+    __slots__ = ('grid', 'steps', 'speed', 'paused', 'due', 'last', 'placed')
 
-    for num in range(9):                                    # Check column
-        if board[num][pos[1]] == guess and pos[0] != num:
-            return False
+    SPEEDS = (1, 2, 5, 10, 50, None)    # Multiples of 10 steps per second, None for unthrottled
+    FRAME_BUDGET = 0.008                # Seconds of solving per frame when unthrottled
+
+    def __init__(self, grid, stats=None):
+        self.grid = grid
+        self.steps = sudoku.backtrack_steps(grid.board, stats)
+        self.speed = 0                  # Index into SPEEDS
+        self.paused = False
+        self.due = 0.0                  # Steps owed since the last frame
+        self.last = time.perf_counter()
+        self.placed = set()             # Squares currently filled by the solver
+
+    def label(self):
+        """
+        Describes the current speed, shown in the window caption.
+        """
+        if self.paused:
+            return 'paused'
+        rate = self.SPEEDS[self.speed]
+        return 'unthrottled' if rate is None else str(rate) + 'x'
+
+    def change_speed(self, step):
+        """
+        Moves step places up or down the list of speeds.
+        """
+        self.speed = min(max(self.speed + step, 0), len(self.SPEEDS) - 1)
+
+    def toggle_pause(self):
+        """
+        Pauses or resumes the playback.
+        """
+        self.paused = not self.paused
+
+    def advance(self):
+        """
+        Runs the steps due since the last frame. Returns False once the solver has finished.
+        """
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+        if self.paused:
+            return True
 
-    box_x = pos[1] // 3
-    box_y = pos[0] // 3
+        rate = self.SPEEDS[self.speed]
+        if rate is None:
+            deadline = now + self.FRAME_BUDGET
+            while time.perf_counter() < deadline:
+                if not self.step():
+                    return False
+            return True
 
-    for row in range(box_y * 3, box_y * 3 + 3):             # Check box/quadrant
-        for col in range(box_x * 3, box_x * 3 + 3):
-            if board[row][col] == guess and (row, col) != pos:
+        self.due += elapsed * 10 * rate
+        while self.due >= 1:
+            self.due -= 1
+            if not self.step():
                 return False
+        return True
 
-    return True
+    def step(self):
+        """
+        Applies the solver's next move to the squares. Returns False when there are no moves left.
+        """
+        move = next(self.steps, None)
+        if move is None:
+            self.finish()
+            return False
+        action, row, col, num = move
+        if action == 'place':
+            self.grid.set_value(row, col, num)
+            self.grid.squares[row][col].set_outline('green')
+            self.placed.add((row, col))
+        else:
+            self.grid.set_value(row, col, 0)
+            self.grid.squares[row][col].set_outline('red')
+            self.placed.discard((row, col))
+        return True
 
+    def finish(self):
+        """
+        Clears the solver outlines.
+        """
+        for row in self.grid.squares:
+            for square in row:
+                square.set_outline(None)
 
-def find_empty(board):
+    def cancel(self):
+        """
+        Stops the solver and takes back every number it placed.
+        """
+        self.steps.close()
+        for row, col in self.placed:
+            self.grid.set_value(row, col, 0)
+        self.placed.clear()
+        self.finish()
+
+
+class Jukebox:
     """
-    Find next empty spot on board.
+    Plays the songs in the music folder in a random order, never repeating one until every song has played, even
+    across turning the music off and on. The folder is listed and the next song decoded in background threads, and
+    the mixer is only started the first time music is turned on, so none of it holds up the menu or a frame.
     """
-    for row in range(9):
-        for col in range(9):
-            if board[row][col] == 0:
-                return row, col
+    __slots__ = ('directory', 'names', 'songs', 'listed', 'next', 'loader', 'channel')
+
+    def __init__(self, directory=MUSIC):
+        self.directory = directory
+        self.names = []                 # Every song in the folder
+        self.songs = []                 # Songs not played yet this round
+        self.listed = threading.Event()     # Set once the folder has been listed
+        self.next = None                # Decoded pygame.mixer.Sound to play next
+        self.loader = None              # Thread decoding the next song
+        self.channel = None             # Channel the current song plays on
+        threading.Thread(target=self.index, name='music-index', daemon=True).start()
+
+    def index(self):
+        """
+        Lists the songs in the music folder. A missing folder just means there is nothing to play.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        self.names = sorted(name for name in names if not name.startswith('.'))    # Skips .DS_Store
+        self.listed.set()
+
+    def prepare(self):
+        """
+        Picks and decodes the next song, starting a new round once every song has played.
+        """
+        self.listed.wait()
+        if not self.songs:
+            self.songs = list(self.names)
+        self.next = None
+        while self.songs and self.next is None:
+            pick = random.choice(self.songs)
+            self.songs.remove(pick)
+            try:
+                self.next = pygame.mixer.Sound(os.path.join(self.directory, pick))
+            except pygame.error:        # Not a sound file pygame can read, try another
+                pass
+
+    def preload(self):
+        """
+        Starts decoding the next song in the background.
+        """
+        self.loader = threading.Thread(target=self.prepare, name='music-decode', daemon=True)
+        self.loader.start()
 
+    def play(self):
+        """
+        Plays the next song, starting the mixer the first time, and begins decoding the one after it.
+        """
+        if self.loader is None:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            self.preload()
+        self.loader.join()              # Normally finished while the last song played
+        sound = self.next
+        self.preload()
+        self.channel = sound.play() if sound is not None else None
+        if self.channel is not None:
+            self.channel.set_endevent(SONG_ENDED)  # Wakes the main loop when the song is over
+
+    def stop(self):
+        """
+        Stops the current song.
+        """
+        if self.channel is not None:
+            self.channel.set_endevent()     # Stopping is not the song ending
+            self.channel.stop()
+            self.channel = None
 
-def draw_window(win, board, run_time, menu, music_on=False):
+
+class Overlay:
     """
-    Creates and draws the game window as well as the menu and options for music and a new game.
+    Diagnostic readout of the frames drawn per second and the CPU time the game used as a share of one core,
+    measured over the last second and drawn above the buttons in the bottom bar.
     """
-    if menu:                                            # If user clicks back to menu
-        font = pygame.font.SysFont("libian", 40)
-        easy = font.render('Easy', True, (0, 0, 0))
-        med = font.render('Medium', True, (0, 0, 0))
-        hard = font.render('Hard', True, (0, 0, 0))
-        solve = font.render('Press space to view the solution', True, (0, 0, 0))
-        win.blit(easy, (230, 125))
-        win.blit(med, (210, 225))
-        win.blit(hard, (230, 325))
-        win.blit(solve, (35, 425))
+    __slots__ = ('frames', 'wall', 'cpu', 'text', 'surface')
 
-    else:
-        win.fill("white")
-        font = pygame.font.SysFont("comicsans", 40)
-        time_text = font.render("Time: " + timer(run_time), True, (0, 0, 0))
+    def __init__(self):
+        self.frames = 0                 # Frames drawn since the last measurement
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.text = 'fps -  cpu -'
+        self.surface = None             # Rendered text, until it changes
+
+    def frame(self):
+        """
+        Counts one drawn frame.
+        """
+        self.frames += 1
+
+    def measure(self):
+        """
+        Updates the readout from the frames and CPU time since the last call.
+        """
+        wall, cpu = time.perf_counter(), time.process_time()
+        elapsed = wall - self.wall
+        if elapsed > 0:
+            self.text = 'fps %d  cpu %d%%' % (round(self.frames / elapsed), round((cpu - self.cpu) / elapsed * 100))
+            self.surface = None
+        self.frames, self.wall, self.cpu = 0, wall, cpu
+
+    def draw(self, win, board):
+        """
+        Draws the readout and returns the rectangles it covers.
+        """
+        if self.surface is None:
+            self.surface = font("comicsans", 18).render(self.text, True, (128, 128, 128))
+        area = pygame.Rect(5, board.height + 3, 200, 16)
+        win.blit(board.background, area, area)
+        win.blit(self.surface, area)
+        return [area]
+
+
+@functools.lru_cache(maxsize=None)
+def jukebox():
+    """
+    Returns the shared music player, starting to list the songs the first time.
+    """
+    return Jukebox()
+
+
+def puzzle_pool(box=3):
+    """
+    Returns the shared pool of prepared games for a board size, starting it the first time so it can fill while the
+    menu is shown. Big boards are generated rather than read from the puzzle file and take seconds each, so fewer
+    of them are kept ready.
+    """
+    if box not in POOLS:
+        POOLS[box] = prefetch.PuzzlePool(size=4 if box <= 3 else 1,
+                                         make=functools.partial(prefetch.make_puzzle, box=box))
+    return POOLS[box]
+
+
+def font(name, size):
+    """
+    Returns a font, loading it only the first time it is asked for.
+    """
+    key = (name, size)
+    if key not in FONTS:
+        FONTS[key] = pygame.font.SysFont(name, size)
+    return FONTS[key]
+
+
+def cell_fonts(width, size):
+    """
+    Font sizes for the numbers and pencil marks of a board size squares across, scaled from the 40 and 16 point
+    fonts of the 9x9 board. Pencil marks come back as None when the squares are too small to fit them.
+    """
+    gap = width / size
+    mark = gap / math.isqrt(size)                       # Room for one pencil mark
+    return int(gap * 2 / 3), max(int(mark * 0.8), 8) if mark >= 8 else None
+
+
+def glyph(text, colour, name="comicsans", size=40):
+    """
+    Returns the rendered surface for a digit or label, rendering it only the first time. Text that changes every
+    frame (like the clock) should be rendered directly instead so the cache stays small.
+    """
+    key = (text, colour, name, size)
+    if key not in GLYPHS:
+        GLYPHS[key] = font(name, size).render(str(text), True, colour)
+    return GLYPHS[key]
+
+
+def load_glyphs(width=540, size=9):
+    """
+    Pre-renders the digits (letters past 9 on big boards) in every colour and size the board uses.
+    """
+    digit_size, mark_size = cell_fonts(width, size)
+    for colour in ((0, 0, 0), (128, 128, 128)):
+        for digit in range(1, size + 1):
+            glyph(sudoku.SYMBOLS[digit], colour, "comicsans", digit_size)
+            if mark_size is not None:
+                glyph(sudoku.SYMBOLS[digit], colour, "comicsans", mark_size)   # Pencil marks
+
+
+def draw_window(win, board, run_time, menu, music_on=False, box=3):
+    """
+    Creates and draws the game window as well as the menu and options for music and a new game. Returns the list of
+    rectangles that changed.
+    """
+    if menu:                                            # If user clicks back to menu
+        win.fill('white')
+        win.blit(glyph('Easy', (0, 0, 0), "libian"), (230, 125))
+        win.blit(glyph('Medium', (0, 0, 0), "libian"), (210, 225))
+        win.blit(glyph('Hard', (0, 0, 0), "libian"), (230, 325))
+        win.blit(glyph('Press space to view the solution', (0, 0, 0), "libian"), (35, 425))
+        win.blit(glyph('Size: %dx%d' % (box * box, box * box), (0, 0, 0), "libian"), (200, 500))
+        return [win.get_rect()]
+
+    rects = board.draw(win)
+    status = (timer(run_time), music_on)
+    if status != board.status:                          # Bottom bar only changes once a second or on music toggle
+        board.status = status
+        bar = pygame.Rect(0, board.height, win.get_width(), win.get_height() - board.height)
+        win.blit(board.background, bar, bar)
+        time_text = font("comicsans", 40).render("Time: " + timer(run_time), True, (0, 0, 0))
         if music_on:                                    # Changes color of music text to green if user selects music
-            music_text = font.render("Music", True, (0, 255, 0))
+            music_text = glyph("Music", (0, 255, 0))
         else:
-            music_text = font.render("Music", True, (0, 0, 0))
-        restart_text = font.render("New Game", True, (0, 0, 0))
-        hint_text = font.render("Hint", True, (0, 0, 0))
-        win.blit(restart_text, (10, 560))
+            music_text = glyph("Music", (0, 0, 0))
+        win.blit(glyph("New Game", (0, 0, 0)), (10, 560))
         win.blit(music_text, (170, 560))
-        win.blit(hint_text, (265, 560))
+        win.blit(glyph("Hint", (0, 0, 0)), (265, 560))
         win.blit(time_text, (540 - 160, 560))
-        board.draw(win)
+        rects.append(bar)
+    return rects
 
 
 def timer(sec):
@@ -310,28 +689,11 @@ def menu_click(pos):
         return 'medium'
     if 230 < x < 295 and 325 < y < 375:
         return 'hard'
+    if 190 < x < 360 and 500 < y < 550:
+        return 'size'
     return None
 
 
-def music(music_on, songs):
-    """
-    Plays music if user turns it on. Chooses random song and removes from queue. If queue is empty the list is
-    re-shuffled.
-    """
-    if not songs:
-        songs = os.listdir('Music')
-        if '.DS_Store' in songs:
-            songs.remove('.DS_Store')
-    if music_on:
-        pick = random.choice(songs)
-        song = 'Music/' + pick
-        songs.remove(pick)
-        pygame.mixer.music.load(song)
-        pygame.mixer.music.play()
-    else:
-        pygame.mixer.music.stop()
-
-
 def clicked(pos):
     """
     Checks for selection of new game, music, or hint.
@@ -345,43 +707,59 @@ def clicked(pos):
         return 'hint'                       # Hint selection
 
 
-def main(music_on=False):
+def menu(win, box, music_on, player):
     """
-    Main function to drive game.
+    Shows the menu until a difficulty is picked and returns (difficulty, box size), or (None, box size) if the
+    window is closed. The menu only changes when clicked, so it sleeps on the event queue in between.
     """
-    win = pygame.display.set_mode((540, 600))   # Initialize window object
-    win.fill('white')
     pygame.display.set_caption("Sudoku")
-
-    songs = os.listdir('Music')                 # Initialize songs
-    if '.DS_Store' in songs:
-        songs.remove('.DS_Store')
-    diff = None                                 # Initialize difficulty
-    menu = True                                 # Keep track if user clicks menu button
-    if menu:                                    # Menu loop
-        run = True
-        while run:
-            draw_window(win, False, False, menu)
-            pygame.display.update()
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    sys.exit()
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    pos = pygame.mouse.get_pos()
-                    diff = menu_click(pos)
-                    if diff:
-                        run = False
-        menu = False
-
-    game = Grid(9, 9, 540, 540, diff)          # Initialize game from user specified difficulty
+    pygame.display.update(draw_window(win, False, False, True, box=box))    # Menu is static, draw it once
+    while True:
+        event = pygame.event.wait()
+        if event.type == pygame.QUIT:
+            return None, box
+        if event.type == SONG_ENDED and music_on:                           # Keep the music going on the menu
+            player.play()
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            pos = pygame.mouse.get_pos()
+            diff = menu_click(pos)
+            if diff == 'size':                                              # Cycle through the board sizes
+                box = SIZES[(SIZES.index(box) + 1) % len(SIZES)]
+                puzzle_pool(box)
+                pygame.display.update(draw_window(win, False, False, True, box=box))
+            elif diff:
+                return diff, box
+
+
+def play(win, diff, box, music_on, player, fps=FPS, overlay=None):
+    """
+    Plays one game. Returns (music_on, True) when the user goes back to the menu and (music_on, False) when the
+    window is closed. Frames are capped at fps (None for no cap). While nothing is animating the loop sleeps on the
+    event queue, woken by input, the once a second clock tick or the end of a song, and the window is only redrawn
+    after something changed.
+    """
+    size = box * box
+    game = Grid(size, size, 540, 540, diff)     # Initialize game from user specified difficulty and size
+    visual = None                               # Solver playback, while it runs
+    hinted = None                               # Last hint given, named in the title
     key = None
-    run = True
+    clock = pygame.time.Clock()
+    changed = True                              # Something may need redrawing
     start_time = time.time()                    # Start time
-    while run:
-        run_time = round(time.time() - start_time)
-        for action in pygame.event.get():
+    while True:
+        if visual is None and not changed:      # Idle, wait for something to happen
+            events = [pygame.event.wait()] + pygame.event.get()
+        else:
+            events = pygame.event.get()
+        for action in events:
+            if action.type != pygame.MOUSEMOTION:
+                changed = True
             if action.type == pygame.QUIT:
-                run = False
+                return music_on, False
+            if action.type == SONG_ENDED and music_on:                      # If song ended but music still selected
+                player.play()
+            if action.type == TICK and overlay is not None:
+                overlay.measure()
             if action.type == pygame.KEYDOWN:
                 if action.key == pygame.K_1:
                     key = 1
@@ -401,50 +779,117 @@ def main(music_on=False):
                     key = 8
                 if action.key == pygame.K_9:
                     key = 9
-                if action.key == pygame.K_BACKSPACE:
+                if key is not None and key > size:                          # 4x4 boards only take 1 - 4
+                    key = None
+                if pygame.K_a <= action.key <= pygame.K_p and action.key - pygame.K_a + 10 <= size:
+                    key = action.key - pygame.K_a + 10                      # Letters are 10 - 25 on big boards
+                elif action.key == pygame.K_p:                              # Toggle pencil marks
+                    game.toggle_pencil()
+                if visual is not None:                                      # The board is the solver's while it plays
+                    key = None
+                if action.key == pygame.K_F3:                               # Show or hide the FPS and CPU overlay
+                    overlay = None if overlay is not None else Overlay()
+                    game.redraw = True
+                if action.key == pygame.K_BACKSPACE and visual is None:
                     game.delete()
                     key = None
-                if action.key == pygame.K_RETURN and game.selected:
+                if action.key == pygame.K_RETURN and game.selected and visual is None:
                     row, col = game.selected
                     if game.squares[row][col].temp != 0:
                         game.place(game.squares[row][col].temp)
                         key = None
                     if game.finished() and sudoku.valid_board(game.board):  # Verifies game board is correct and done
                         print('You finished it! Good job.')
-                if action.key == pygame.K_SPACE:                            # Solves game
-                    game.solve_visual(win)
+                if action.key == pygame.K_SPACE:                            # Solves game, or pauses it
+                    if visual is None:
+                        visual = SolverVisual(game)
+                    else:
+                        visual.toggle_pause()
+                if visual is not None:
+                    if action.key == pygame.K_ESCAPE:                       # Cancel solver
+                        visual.cancel()
+                        visual = None
+                    elif action.key in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+                        visual.change_speed(1)
+                    elif action.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                        visual.change_speed(-1)
 
             if action.type == pygame.MOUSEBUTTONDOWN:
                 pos = pygame.mouse.get_pos()
                 selection = clicked(pos)
                 if selection == 'menu':                                     # Menu selection
-                    run = False
-                    menu = True
+                    return music_on, True
                 elif selection == 'music':                                  # Music selection
                     if music_on is False:
                         music_on = True
+                        player.play()
                     else:
                         music_on = False
-                    music(music_on, songs)
+                        player.stop()
                 elif selection == 'hint':                                   # Hint selection
-                    game.hint()
+                    if visual is None:                                      # Not while the solver is guessing
+                        hinted = game.hint()
                 else:
                     click = game.board_click(pos)                           # Check for square selection
                     if click:
                         game.select(click[0], click[1])
                         key = None
 
-        if not pygame.mixer.music.get_busy() and music_on:                  # If song ended but music still selected
-            music(music_on, songs)
-
-        if game.selected and key is not None:
-            game.sketch(key)
-
-        draw_window(win, game, run_time, menu, music_on)                    # Keep drawing and updating window
-        pygame.display.update()
-
-    if menu:
-        main(music_on)
+        if visual is not None and not visual.advance():                     # Play back a few solver steps
+            visual = None
+            changed = True                                                  # Draw the last steps right away
+        if visual:
+            title = "Sudoku " + game.id + " - solving " + visual.label()
+        else:
+            title = "Sudoku " + game.id + (" - hint: " + hinted.technique if hinted else "")
+        if title != pygame.display.get_caption()[0]:
+            pygame.display.set_caption(title)
+
+        if changed or visual is not None:
+            if game.selected and key is not None:
+                game.sketch(key)
+            run_time = round(time.time() - start_time)
+            rects = draw_window(win, game, run_time, False, music_on)       # Redraw only what changed
+            if overlay is not None:
+                overlay.frame()
+                rects.extend(overlay.draw(win, game))
+            if rects:
+                pygame.display.update(rects)
+            changed = False
+        clock.tick(fps or 0)
+
+
+def main(music_on=False, box=3, startup=False, fps=FPS, overlay=False):
+    """
+    Main function to drive game. Only the display and fonts are started up front; the music is listed in the
+    background and the mixer started when music is first turned on. With startup the time from import to the first
+    menu frame is printed and the game exits there. fps caps the frame rate and overlay shows the frame rate and
+    CPU use from the start (F3 toggles it in game).
+    """
+    puzzle_pool(box)                            # Start preparing games
+    player = jukebox()                          # Start listing songs
+    pygame.display.init()
+    pygame.font.init()
+    win = pygame.display.set_mode((540, 600))   # Initialize window object
+    win.fill('white')
+    if startup:
+        pygame.display.update(draw_window(win, False, False, True, box=box))
+        print('Menu shown %.1f ms after import' % ((time.perf_counter() - STARTED) * 1000), flush=True)
+        return
+
+    pygame.time.set_timer(TICK, 1000)           # Wakes the idle loop to update the clock
+    again = True
+    while again:                                # Back and forth between the menu and games
+        diff, box = menu(win, box, music_on, player)
+        if diff is None:
+            return
+        music_on, again = play(win, diff, box, music_on, player, fps, Overlay() if overlay else None)
 
 
-main()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Play Sudoku.')
+    parser.add_argument('--startup', action='store_true', help='print the time to the first menu frame and exit')
+    parser.add_argument('--fps', type=int, default=FPS, help='frame rate cap, 0 for none (default: %d)' % FPS)
+    parser.add_argument('--overlay', action='store_true', help='show the frame rate and CPU use (F3 in game)')
+    args = parser.parse_args()
+    main(startup=args.startup, fps=args.fps, overlay=args.overlay)
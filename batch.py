@@ -0,0 +1,173 @@
+# Author: Joseph Caswell
+# Project: Sudoku batch solver
+
+import numpy
+import sudoku
+
+DIGIT = numpy.array([bits.bit_length() if bits & (bits - 1) == 0 else 0 for bits in range(512)], dtype=numpy.uint8)
+ALL_DIGITS = numpy.uint16(511)
+POPCOUNT = numpy.array([bin(bits).count('1') for bits in range(512)], dtype=numpy.uint8)
+GUESSES = 3                                     # Rounds of batched guessing before the one at a time search
+GIVEN = numpy.array([511] + [1 << (digit - 1) for digit in range(1, 10)], dtype=numpy.uint16)     # Cell value -> bits
+
+
+def candidates(puzzles):
+    """
+    Builds the candidates of a batch of flat 9x9 puzzles as an (81, N) uint16 array, one row per cell and one column
+    per puzzle. This is the (N, 81, 9) boolean candidate tensor with the digit axis packed into bits (bit d - 1 of a
+    cell is set while digit d may still go there, as in the bitmask solver) and the cell axis first, so that every
+    row, column and box reduction below runs over long contiguous runs of puzzles. Givens start with their own
+    digit only, empty cells with all nine.
+    """
+    puzzles = numpy.asarray(puzzles, dtype=numpy.uint8).reshape(-1, 81).T
+    return numpy.ascontiguousarray(GIVEN[puzzles])
+
+
+def reduce_units(masks, ufunc, dtype=None):
+    """
+    Reduces the cells of every row, column and box of a batch with a ufunc. Rows and columns are axes of the
+    (9, 9, N) reshape of the cells and boxes two axes of a (3, 3, 3, 3, N) reshape, so nothing is copied. Returns
+    (rows, columns, boxes) shaped (9, N), (9, N) and (3, 3, N).
+    """
+    grid = masks.reshape(9, 9, -1)
+    return (ufunc.reduce(grid, axis=1, dtype=dtype), ufunc.reduce(grid, axis=0, dtype=dtype),
+            ufunc.reduce(masks.reshape(3, 3, 3, 3, -1), axis=(1, 3), dtype=dtype))
+
+
+def spread(rows, cols, boxes):
+    """
+    Sends one value per unit back to the cells: each cell gets the OR of the values of its row, column and box, as
+    an (81, N) array.
+    """
+    cells = rows[:, None] | cols[None, :]
+    boxed = cells.reshape(3, 3, 3, 3, -1)
+    boxed |= boxes[:, None, :, None]
+    return cells.reshape(81, -1)
+
+
+def seen_once(masks):
+    """
+    Returns the digits that appear as a candidate in exactly one cell of each row, column and box, as (rows, columns,
+    boxes) like reduce_units, and a boolean array marking the puzzles where some digit has no cell left at all.
+    """
+    grid = masks.reshape(9, 9, -1)
+    boxed = masks.reshape(3, 3, 3, 3, -1)
+    kinds = ([grid[:, slot] for slot in range(9)], [grid[slot] for slot in range(9)],
+             [boxed[:, row, :, col] for row in range(3) for col in range(3)])
+    found, missing = [], numpy.zeros(masks.shape[1], dtype=bool)
+    for slots in kinds:
+        once = numpy.zeros_like(slots[0])
+        more = numpy.zeros_like(once)
+        for cells in slots:                             # Digits seen once so far, and seen again
+            more |= once & cells
+            once |= cells
+        missing |= (once != ALL_DIGITS).reshape(-1, masks.shape[1]).any(axis=0)
+        found.append(once & ~more)
+    return found, missing
+
+
+def singles(masks):
+    """
+    Runs one round of naked and hidden singles on every puzzle of the batch at once. Returns the new candidates and
+    a boolean array marking the puzzles that reached a contradiction: a digit twice in a unit, a digit with no cell
+    left in a unit, a cell needed for two digits or a cell with no candidates.
+    """
+    fixed = masks * ((masks & (masks - 1)) == 0)                                # Digits of solved cells
+    placed = reduce_units(fixed, numpy.bitwise_or)
+    added = reduce_units(fixed, numpy.add, numpy.int32)
+    twice = numpy.zeros(masks.shape[1], dtype=bool)
+    for bits, total in zip(placed, added):                                      # Bits only add up when distinct
+        twice |= (bits != total).reshape(-1, masks.shape[1]).any(axis=0)
+    masks = masks & (~spread(*placed) | fixed)                                  # Naked singles
+
+    found, missing = seen_once(masks)
+    hidden = masks & spread(*found)                                             # Hidden singles
+    several = (hidden & (hidden - 1)) != 0
+    masks ^= (masks ^ hidden) * ((hidden != 0) & ~several)                      # Cells with one hidden single
+
+    broken = twice | missing | several.any(axis=0) | (masks == 0).any(axis=0)
+    return masks, broken
+
+
+def propagate(masks):
+    """
+    Repeats rounds of singles until no puzzle of the batch changes. Puzzles drop out of the working set as soon as
+    they are finished, stuck or broken, so the late rounds only touch the puzzles still making progress. Returns the
+    candidates and the broken marks.
+    """
+    masks = masks.copy()
+    broken = numpy.zeros(masks.shape[1], dtype=bool)
+    active = numpy.arange(masks.shape[1])
+    while active.size:
+        part = numpy.take(masks, active, axis=1)       # Keeps the cell major layout, unlike masks[:, active]
+        after, failed = singles(part)
+        masks[:, active] = after
+        broken[active] = failed
+        moving = (after != part).any(axis=0) & ~failed & (after & (after - 1)).any(axis=0)
+        active = active[moving]
+    return masks, broken
+
+
+def guess(masks, origin):
+    """
+    Splits every puzzle of the batch on its unsolved cell with the fewest candidates, one copy per candidate with the
+    cell set to it. origin maps each puzzle to the puzzle it came from and is carried over to the copies. Returns
+    the new candidates and origins.
+    """
+    counts = POPCOUNT[masks]
+    counts[counts == 1] = 10                            # Solved cells are never picked
+    cells = counts.argmin(axis=0)
+    choices = masks[cells, numpy.arange(masks.shape[1])]
+    parts, origins = [], []
+    for digit in range(9):
+        bit = numpy.uint16(1 << digit)
+        pick = numpy.flatnonzero(choices & bit)
+        copy = numpy.take(masks, pick, axis=1)
+        copy[cells[pick], numpy.arange(len(pick))] = bit
+        parts.append(copy)
+        origins.append(origin[pick])
+    return numpy.concatenate(parts, axis=1), numpy.concatenate(origins)
+
+
+def solve(puzzles, chunk=4096, guesses=GUESSES):
+    """
+    Solves a batch of flat 9x9 puzzles, anything NumPy can view as (N, 81) or (N, 9, 9) integers. Propagation runs
+    on all of them together, chunk puzzles at a time to bound memory. Puzzles it leaves stuck are split on a guess
+    and propagated again, together, up to guesses times. Every board found is checked with sudoku.valid_boards and
+    against its givens, and only the puzzles still unsolved after that, plus any that fail the check, are solved
+    one at a time with sudoku.solve_propagate. Returns an (N, 81) uint8 array of solutions and a boolean array
+    marking the puzzles that have one; rows without a solution are zero. Puzzles with several solutions get one of
+    them.
+    """
+    puzzles = numpy.asarray(puzzles, dtype=numpy.uint8).reshape(-1, 81)
+    solutions = numpy.zeros_like(puzzles)
+    solved = numpy.zeros(len(puzzles), dtype=bool)
+    for start in range(0, len(puzzles), chunk):
+        part = puzzles[start:start + chunk]
+        found = solutions[start:start + chunk]
+        done = solved[start:start + chunk]
+        masks, broken = propagate(candidates(part))
+        origin = numpy.arange(len(part))
+        for attempt in range(guesses + 1):
+            boards = numpy.ascontiguousarray(DIGIT[masks].T)
+            complete = (boards > 0).all(axis=1) & ~broken
+            check = numpy.flatnonzero(complete & ~done[origin])
+            good = sudoku.valid_boards(boards[check]) & ((part[origin[check]] == 0) |
+                                                         (part[origin[check]] == boards[check])).all(axis=1)
+            check = check[good]
+            ids, first = numpy.unique(origin[check], return_index=True)    # One board per puzzle
+            found[ids] = boards[check[first]]
+            done[ids] = True
+
+            stuck = numpy.flatnonzero(~complete & ~broken & ~done[origin])[:chunk]     # Bounds the copies made
+            if attempt == guesses or not stuck.size:
+                break
+            masks, origin = guess(numpy.take(masks, stuck, axis=1), origin[stuck])
+            masks, broken = propagate(masks)
+
+    for index in numpy.flatnonzero(~solved):            # Left to the one at a time search
+        solution = sudoku.solve_propagate(puzzles[index].tolist())
+        if solution is not None:
+            solutions[index] = solution
+            solved[index] = True
+    return solutions, solved
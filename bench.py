@@ -0,0 +1,286 @@
+# Author: Joseph Caswell
+# Project: Sudoku benchmarks
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import canonical
+import puzzles
+import sudoku
+
+SEED = 2024
+HARD = (                                # Known hard puzzles that are not in boards.txt
+    ('17 clue', '000000010400000000020000000000050407008000300001090000300400200050100000000806000'),
+    ('17 clue', '000000010400000000020000000000050604008000300001090000300400200050100000000807000'),
+    ('anti-backtracking', '000000000000003085001020000000507000004000100090000000500000073002010000000040009'),
+    ('ai escargot', '100007090030020008009600500005300900010080002600004000300000010040000007007000300'),
+    ('arto inkala', '800000000003600000070090200050007000000045700000100030001000068008500010090000400'),
+)
+
+
+def corpora(rng, count):
+    """
+    Draws the fixed puzzle sets every benchmark runs on: count puzzles of each difficulty from boards.txt, plus the
+    known hard puzzles. The same seed always gives the same puzzles.
+    """
+    store = puzzles.load()
+    sets = {diff: [store.random(diff, rng) for _ in range(count)] for diff in puzzles.DIFFICULTIES}
+    sets['known hard'] = [sudoku.parse_puzzle(line) for name, line in HARD]
+    return sets
+
+
+def percentile(times, fraction):
+    """
+    Returns the value below which the given fraction of sorted times fall (nearest rank).
+    """
+    return times[min(len(times) - 1, int(fraction * len(times)))]
+
+
+def timed(fn, inputs, repeat):
+    """
+    Calls fn on every input repeat times and returns the timing distribution in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        for args in inputs:
+            start = time.perf_counter()
+            fn(*args)
+            times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {'calls': len(times), 'mean_ms': sum(times) / len(times), 'p50_ms': percentile(times, 0.5),
+            'p99_ms': percentile(times, 0.99), 'max_ms': times[-1]}
+
+
+def allocations(fn, inputs):
+    """
+    Calls fn once on every input under tracemalloc and returns the number of memory blocks allocated and the peak
+    traced memory per call.
+    """
+    tracemalloc.start()
+    try:
+        blocks, peak = 0, 0
+        for args in inputs:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            fn(*args)
+            current, top = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            blocks += sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+            peak = max(peak, top - current)
+    finally:
+        tracemalloc.stop()
+    return {'blocks_per_call': blocks / len(inputs), 'peak_kib': peak / 1024}
+
+
+def measure(fn, inputs, repeat):
+    """
+    Times fn over the inputs and, once, counts its allocations.
+    """
+    result = timed(fn, inputs, repeat)
+    result.update(allocations(fn, inputs))
+    return result
+
+
+def solve(cells, engine):
+    """
+    Solves one puzzle through Board.solve.
+    """
+    board = sudoku.Board('hard')
+    board.solved = sudoku.PackedBoard(cells)
+    board.solve(engine)
+
+
+def shuffle(cells, method):
+    """
+    Shuffles one puzzle through Board.shuffle_board.
+    """
+    board = sudoku.Board('hard')
+    board.board = sudoku.PackedBoard(cells)
+    board.shuffle_board(method)
+
+
+def difficulty(diff):
+    """
+    Picks one puzzle through Board.difficulty.
+    """
+    sudoku.Board(diff).difficulty()
+
+
+def solver_benchmarks(sets, repeat):
+    """
+    Board.solve with every engine on every corpus, shuffling, puzzle selection, validation and canonical forms.
+    """
+    results = {}
+    for name, cells in sets.items():
+        inputs = [(puzzle,) for puzzle in cells]
+        for engine in sorted(sudoku.ENGINES):
+            results['solve.%s.%s' % (engine, name)] = measure(solve, [(puzzle, engine) for puzzle in cells], repeat)
+        if name != 'known hard':        # Plain backtracking takes minutes on the anti-backtracking puzzle
+            results['solve.backtrack.%s' % name] = measure(solve, [(puzzle, 'backtrack') for puzzle in cells[:5]], 1)
+        results['canonical_form.%s' % name] = measure(canonical.canonical_form, inputs, 1)
+
+    easy = sets['easy']
+    results['shuffle_board.compose'] = measure(shuffle, [(puzzle, 'compose') for puzzle in easy], repeat)
+    results['shuffle_board.swap'] = measure(shuffle, [(puzzle, 'swap') for puzzle in easy[:5]], 1)
+    results['difficulty'] = measure(difficulty, [(diff,) for diff in puzzles.DIFFICULTIES] * 10, repeat)
+
+    solutions = [sudoku.solve_propagate(puzzle) for puzzle in easy]
+    results['valid_board.packed'] = measure(sudoku.valid_board, [(sudoku.PackedBoard(bytes(solution)),)
+                                                                 for solution in solutions], repeat * 10)
+    results['valid_board.lists'] = measure(sudoku.valid_board, [(sudoku.unflatten(solution),)
+                                                                for solution in solutions], repeat * 10)
+    if sudoku.numpy is not None:
+        import batch                                # Needs NumPy
+        boards = sudoku.numpy.array(solutions * (10000 // len(solutions) + 1), dtype=sudoku.numpy.uint8)
+        results['valid_boards.10000'] = measure(sudoku.valid_boards, [(boards[:10000],)], repeat)
+        for name in puzzles.DIFFICULTIES:           # A whole file's worth of puzzles in one call
+            cells = [list(puzzle) for puzzle in sets[name]]
+            boards = sudoku.numpy.array(cells * (10000 // len(cells) + 1), dtype=sudoku.numpy.uint8)
+            results['solve_batch.%s.10000' % name] = measure(batch.solve, [(boards[:10000],)], repeat)
+    return results
+
+
+def gui_benchmarks(sets, repeat):
+    """
+    Frame times of the GUI draw path on a headless display: the first full frame, an idle frame with nothing to
+    repaint, a frame after placing one number and a full repaint with pencil marks shown.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    try:
+        import pygame
+        import GUI
+    except ImportError:                 # pygame not installed, skip the GUI timings
+        return {}
+    import prefetch
+
+    games = iter(sets['medium'] * (repeat + 1))
+
+    def make(diff):
+        puzzle = next(games)
+        return puzzle, bytes(sudoku.solve_propagate(puzzle)), 'bench'
+
+    GUI.POOLS[3] = prefetch.PuzzlePool(size=0, make=make)   # No queue to fill, every game is made on request
+    pygame.font.init()
+    win = pygame.display.set_mode((540, 600))
+    frames = {'first': [], 'idle': [], 'place': [], 'pencil': []}
+    try:
+        for _ in range(repeat):
+            game = GUI.Grid(9, 9, 540, 540, 'medium')
+            start = time.perf_counter()
+            GUI.draw_window(win, game, 0, False)
+            frames['first'].append(time.perf_counter() - start)
+            for step in range(20):
+                start = time.perf_counter()
+                GUI.draw_window(win, game, 0, False)
+                frames['idle'].append(time.perf_counter() - start)
+            for cell in list(game.unsolved)[:20]:
+                row, col = divmod(cell, 9)
+                game.set_value(row, col, game.solved[row][col])
+                start = time.perf_counter()
+                GUI.draw_window(win, game, 0, False)
+                frames['place'].append(time.perf_counter() - start)
+            game.toggle_pencil()
+            start = time.perf_counter()
+            GUI.draw_window(win, game, 0, False)
+            frames['pencil'].append(time.perf_counter() - start)
+    finally:
+        GUI.POOLS.pop(3).close()
+
+    results = {}
+    for name, times in frames.items():
+        times = sorted(value * 1000 for value in times)
+        results['frame.' + name] = {'calls': len(times), 'mean_ms': sum(times) / len(times),
+                                    'p50_ms': percentile(times, 0.5), 'p99_ms': percentile(times, 0.99),
+                                    'max_ms': times[-1]}
+    return results
+
+
+def startup_benchmarks(repeat):
+    """
+    Cold start of the GUI on a headless display: the wall time from launching a fresh interpreter until the first
+    menu frame is shown, and the part of that after GUI was imported (as printed by GUI.py --startup).
+    """
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', SDL_AUDIODRIVER='dummy')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'GUI.py')
+    launch, menu = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, script, '--startup'], stdout=subprocess.PIPE, env=env, text=True)
+        for line in process.stdout:
+            if line.startswith('Menu shown'):
+                launch.append((time.perf_counter() - start) * 1000)
+                menu.append(float(line.split()[2]))
+        process.wait()
+    if not launch:                      # pygame not installed or no display
+        return {}
+
+    results = {}
+    for name, times in (('startup.launch', launch), ('startup.menu', menu)):
+        times.sort()
+        results[name] = {'calls': len(times), 'mean_ms': sum(times) / len(times), 'p50_ms': percentile(times, 0.5),
+                         'p99_ms': percentile(times, 0.99), 'max_ms': times[-1]}
+    return results
+
+
+def run(seed=SEED, count=20, repeat=5, gui=True):
+    """
+    Runs every benchmark and returns the report. Puzzle choice, shuffling and the global random module are all
+    seeded, so two runs with the same seed do the same work.
+    """
+    random.seed(seed)
+    sets = corpora(random.Random(seed), count)
+    results = solver_benchmarks(sets, repeat)
+    if gui:
+        results.update(gui_benchmarks(sets, repeat))
+        results.update(startup_benchmarks(repeat))
+    return {'seed': seed, 'count': count, 'repeat': repeat, 'python': platform.python_version(),
+            'machine': platform.machine(), 'results': results}
+
+
+def compare(old, new):
+    """
+    Prints the change in p50 and p99 of every benchmark found in both reports.
+    """
+    for name in sorted(new['results']):
+        if name not in old['results']:
+            continue
+        before, after = old['results'][name], new['results'][name]
+        print('%-32s p50 %9.3f -> %9.3f ms (%+6.1f%%)  p99 %9.3f -> %9.3f ms (%+6.1f%%)' % (
+            name, before['p50_ms'], after['p50_ms'], change(before['p50_ms'], after['p50_ms']),
+            before['p99_ms'], after['p99_ms'], change(before['p99_ms'], after['p99_ms'])))
+
+
+def change(before, after):
+    """
+    Percentage change from before to after.
+    """
+    return (after - before) / before * 100 if before else 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the solver, shuffle, validation and drawing hot paths.')
+    parser.add_argument('-s', '--seed', type=int, default=SEED)
+    parser.add_argument('-n', '--count', type=int, default=20, help='puzzles per difficulty')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='timed passes over each corpus')
+    parser.add_argument('-o', '--output', default='-', help='JSON report file, - for stdout (default)')
+    parser.add_argument('--compare', help='earlier JSON report to compare against')
+    parser.add_argument('--no-gui', action='store_true', help='skip the pygame frame and start up timings')
+    args = parser.parse_args()
+
+    report = run(args.seed, args.count, args.repeat, not args.no_gui)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), report)
@@ -0,0 +1,224 @@
+# Author: Joseph Caswell
+# Project: Sudoku canonical forms
+
+import collections
+import itertools
+import sudoku
+
+BANDS = ((0, 1, 2), (3, 4, 5), (6, 7, 8))
+
+
+def relabel(values, mapping):
+    """
+    Renames the digits of values in order of first appearance, extending mapping (old digit -> new digit) as new
+    digits are met. Empty cells stay 0.
+    """
+    out = []
+    for value in values:
+        if value:
+            if value not in mapping:
+                mapping[value] = len(mapping) + 1
+            out.append(mapping[value])
+        else:
+            out.append(0)
+    return tuple(out)
+
+
+def column_orders(row):
+    """
+    Lists every column order (stack order plus column order inside each stack) that puts the row in its smallest
+    relabelled form. A row of a valid puzzle never repeats a digit, so its relabelled form only depends on where
+    the empty cells fall: as many empty cells as possible should come first. That means stacks with fewer givens
+    come first and empty cells lead inside each stack, and only ties between stacks or between cells of the same
+    kind are left to enumerate.
+    """
+    stacks = []
+    for stack in BANDS:
+        blanks = tuple(col for col in stack if not row[col])
+        givens = tuple(col for col in stack if row[col])
+        stacks.append((len(givens), blanks, givens))
+    stacks.sort(key=lambda stack: stack[0])
+
+    groups = [list(group) for count, group in itertools.groupby(stacks, key=lambda stack: stack[0])]
+    stack_orders = [[]]
+    for group in groups:                        # Stacks with the same number of givens can go in any order
+        stack_orders = [order + list(perm) for order in stack_orders for perm in itertools.permutations(group)]
+
+    orders = []
+    for order in stack_orders:
+        choices = [[blanks + givens for blanks in itertools.permutations(stack[1])
+                    for givens in itertools.permutations(stack[2])] for stack in order]
+        for parts in itertools.product(*choices):
+            orders.append(parts[0] + parts[1] + parts[2])
+    return orders
+
+
+def transposed(cells):
+    """
+    Returns the flat board mirrored along its main diagonal.
+    """
+    return [cells[col * 9 + row] for row in range(9) for col in range(9)]
+
+
+class Search:
+    """
+    Finds a canonical representative of a board's class under the whole symmetry group (transpose, band and row
+    order, stack and column order, digit relabelling), comparing relabelled boards with empty cells as the smallest
+    value. Only rows with the most empty cells are tried as the first row, with the column orders that put their
+    blanks first, and the remaining rows are then chosen greedily, only branching on ties. Any partial result worse
+    than the best board so far is dropped. Every step depends only on the class, so all transforms of a board give
+    the same result, but it is not always the lexicographically smallest board of the class.
+    """
+    def __init__(self):
+        self.best = None                        # Smallest board found, as a tuple of row tuples
+        self.transform = None
+
+    def run(self, cells):
+        """
+        Searches both orientations of the board and returns (canonical board, transform).
+        """
+        starts = []
+        for flip in (False, True):
+            grid = transposed(cells) if flip else list(cells)
+            rows = [tuple(grid[row * 9:row * 9 + 9]) for row in range(9)]
+            for first in range(9):
+                key = relabel(sorted(rows[first], key=bool), {})    # Best possible first row for this source row
+                starts.append((key, flip, rows, first))
+        smallest = min(start[0] for start in starts)
+        for key, flip, rows, first in starts:
+            if key != smallest:
+                continue
+            seen = set()
+            for cols in column_orders(rows[first]):
+                permuted = [tuple(row[col] for col in cols) for row in rows]
+                if tuple(permuted) in seen:     # Swapping identical columns changes nothing
+                    continue
+                seen.add(tuple(permuted))
+                band = BANDS[first // 3]
+                rest = [row for row in band if row != first]
+                others = [other for other in BANDS if other != band]
+                self.extend(permuted, [first], rest, others, {}, (), flip, cols)
+        return self.best, self.transform
+
+    def extend(self, rows, chosen, band, bands, mapping, prefix, flip, cols):
+        """
+        Adds the next row, trying every candidate that ties for the smallest relabelled row. band holds the rows
+        left in the current band and bands the bands not started yet.
+        """
+        mapping = dict(mapping)
+        prefix = prefix + (relabel(rows[chosen[-1]], mapping),)
+        depth = len(prefix)
+        if self.best is not None:
+            if prefix > self.best[:depth]:
+                return
+            if prefix < self.best[:depth]:
+                self.best = None                # Anything found so far is worse from here on
+        if depth == 9:
+            self.best = prefix
+            self.transform = (chosen, cols, mapping, flip)
+            return
+
+        if band:
+            candidates = [(row, [other for other in band if other != row], bands) for row in band]
+        else:
+            candidates = [(row, [other for other in next_band if other != row],
+                           [other for other in bands if other != next_band])
+                          for next_band in bands for row in next_band]
+        keyed = []
+        seen = set()
+        for row, next_rows, next_bands in candidates:
+            same = (rows[row], tuple(sorted(rows[other] for other in next_rows)))
+            if same in seen:                    # Identical rows (and bands) lead to identical boards
+                continue
+            seen.add(same)
+            trial = dict(mapping)
+            keyed.append((relabel(rows[row], trial), row, next_rows, next_bands))
+        smallest = min(item[0] for item in keyed)
+        for key, row, next_rows, next_bands in keyed:
+            if key == smallest:
+                self.extend(rows, chosen + [row], next_rows, next_bands, mapping, prefix, flip, cols)
+
+
+def canonical_form(cells):
+    """
+    Maps a flat 81 cell board to the canonical representative of its symmetry class and returns it with the
+    transform that produces it. Two boards are transforms of each other exactly when their canonical forms are
+    equal. The transform uses the (rows, cols, digits, transposed) layout of sudoku.apply_transform, so
+    apply_transform(cells, transform) == canonical. Most puzzles take a few milliseconds; boards with empty rows
+    or no empty cells at all (solutions) leave many more ties to explore and are slower. Only 9x9 boards have a
+    canonical form here; other sizes raise ValueError.
+    """
+    if len(cells) != 81:
+        raise ValueError('canonical forms are only defined for 9x9 boards, not ' + str(len(cells)) + ' cells')
+    best, (rows, cols, mapping, flip) = Search().run(cells)
+    digits = [0] * 10
+    for old, new in mapping.items():
+        digits[old] = new
+    unused = iter(sorted(set(range(1, 10)) - set(mapping.values())))
+    for old in range(1, 10):                    # Digits missing from the board still need a label
+        if old not in mapping:
+            digits[old] = next(unused)
+    canonical = [value for row in best for value in row]
+    return canonical, (list(rows), list(cols), digits, flip)
+
+
+def invert_transform(transform):
+    """
+    Returns the transform that undoes the given one.
+    """
+    rows, cols, digits, flip = transform
+    row_back, col_back, digit_back = [0] * 9, [0] * 9, [0] * 10
+    for index, row in enumerate(rows):
+        row_back[row] = index
+    for index, col in enumerate(cols):
+        col_back[col] = index
+    for old, new in enumerate(digits):
+        digit_back[new] = old
+    if flip:                                    # Transposing swaps the roles of rows and columns on the way back
+        return col_back, row_back, digit_back, True
+    return row_back, col_back, digit_back, False
+
+
+class SolutionCache:
+    """
+    Bounded LRU cache of solutions keyed by the canonical form of the puzzle, so every transform of a puzzle that
+    was solved before is answered by a lookup and the inverse transform. Pass it to Board.solve(cache=...) or call
+    solve() directly. Only 9x9 boards can be cached; solving any other size raises ValueError.
+    """
+    def __init__(self, maxsize=4096, engine='propagate'):
+        self.maxsize = maxsize
+        self.engine = engine
+        self.entries = collections.OrderedDict()    # Canonical puzzle -> canonical solution (or None)
+        self.hits = 0
+        self.misses = 0
+
+    def solve(self, cells):
+        """
+        Returns the solution of a flat 81 cell board as a list, or None if it has no solution.
+        """
+        canonical, transform = canonical_form(cells)
+        key = bytes(canonical)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            solution = self.entries[key]
+        else:
+            self.misses += 1
+            solution = sudoku.ENGINES[self.engine](canonical)
+            self.entries[key] = solution
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        if solution is None:
+            return None
+        return sudoku.apply_transform(solution, invert_transform(transform))
+
+
+def duplicates(puzzles):
+    """
+    Groups puzzles that are transforms of one another. Takes an iterable of flat boards and returns lists of the
+    indexes of puzzles sharing a symmetry class, for every class with more than one member.
+    """
+    classes = collections.defaultdict(list)
+    for index, cells in enumerate(puzzles):
+        classes[bytes(canonical_form(cells)[0])].append(index)
+    return [members for members in classes.values() if len(members) > 1]
@@ -0,0 +1,332 @@
+# Author: Joseph Caswell
+# Project: Sudoku portfolio solver
+
+import argparse
+import collections
+import math
+import multiprocessing
+import multiprocessing.connection
+import random
+import sys
+import time
+import sudoku
+
+BUDGET = 2.0                        # Default seconds a solve may take before it gives up
+RESTART = 64                        # Nodes allowed before the first restart, doubled every restart after
+GRACE = 0.5                         # Seconds a cancelled strategy gets to stop before its process is replaced
+
+Result = collections.namedtuple('Result', 'solution strategy status seconds nodes')
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a strategy when its job was won by another strategy or ran out of time.
+    """
+
+
+class Restart(Exception):
+    """
+    Raised inside a strategy when it used up its node limit.
+    """
+
+
+class Watch(sudoku.SolveStats):
+    """
+    SolveStats that keeps a strategy on a leash through the node hook every engine already calls. At every node it
+    raises Cancelled once current (a shared job number) no longer holds its job or the deadline has passed, and
+    Restart once limit nodes have been visited. Both checks cost far less than the propagation pass behind a node.
+    """
+    __slots__ = ('job', 'current', 'deadline', 'limit')
+
+    def __init__(self, job, current, deadline):
+        super().__init__()
+        self.job = job
+        self.current = current
+        self.deadline = deadline        # time.monotonic() value, which every process shares
+        self.limit = math.inf
+
+    def node(self, depth):
+        """
+        Counts a search node and stops the search if it has to.
+        """
+        self.nodes += 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if self.nodes >= self.limit:
+            raise Restart
+        if self.current.value != self.job or time.monotonic() > self.deadline:
+            raise Cancelled
+
+
+def most_constrained(cells, rng, watch):
+    """
+    The propagate engine as is: singles, then a guess on the cell with the fewest candidates (the first one in
+    reading order on a tie) trying digits from 1 up.
+    """
+    return sudoku.solve_propagate(cells, stats=watch)
+
+
+def reversed_scan(cells, rng, watch):
+    """
+    The propagate engine on the board turned 180 degrees, so ties between cells go to the bottom right and digits
+    are still tried from 1 up. Puzzles built against a top left scan look ordinary from this side.
+    """
+    solution = sudoku.solve_propagate(cells[::-1], stats=watch)
+    return solution and solution[::-1]
+
+
+def shuffled_board(cells, rng, watch):
+    """
+    The propagate engine on a random symmetry of the board (see sudoku.random_transform), which gives it a random
+    cell order for ties and a random digit order. The solution is mapped back to the original board.
+    """
+    size = math.isqrt(len(cells))
+    transform = rows, cols, digits, transposed = sudoku.random_transform(rng, True, math.isqrt(size))
+    solution = sudoku.solve_propagate(sudoku.apply_transform(cells, transform), stats=watch)
+    if solution is None:
+        return None
+    if transposed:
+        sources = [col * size + row for row in rows for col in cols]
+    else:
+        sources = [row * size + col for row in rows for col in cols]
+    values = [0] * len(digits)
+    for old, new in enumerate(digits):
+        values[new] = old
+    original = [0] * len(cells)
+    for cell, source in zip(solution, sources):
+        original[source] = values[cell]
+    return original
+
+
+def random_restarts(cells, rng, watch):
+    """
+    The propagate engine trying digits in a random order, started over with a fresh order whenever it has used up
+    its node limit. The limit starts at RESTART nodes and doubles every time, so an unlucky order is dropped early
+    while the search stays complete: a run that finishes without a solution proves there is none.
+    """
+    limit = RESTART
+    while True:
+        watch.limit = watch.nodes + limit
+        try:
+            return sudoku.solve_propagate(cells, rng, watch)
+        except Restart:
+            limit *= 2
+
+
+def exact_cover(cells, rng, watch):
+    """
+    The Dancing Links engine, which does not depend on a cell or digit order at all.
+    """
+    return sudoku.solve_dlx(cells, stats=watch)
+
+
+STRATEGIES = {                      # Strategy name -> fn(cells, rng, watch) returning a solution or None
+    'propagate': most_constrained,
+    'reversed': reversed_scan,
+    'shuffled': shuffled_board,
+    'restarts': random_restarts,
+    'dlx': exact_cover,
+}
+
+
+def worker(name, connection, current):
+    """
+    Process loop for one strategy: receives (job, cells, deadline, seed) messages and answers each with (job,
+    strategy, solution, status, nodes, seconds) until it receives None or the connection closes. A first answer
+    for job 0 tells the portfolio the process is ready.
+    """
+    strategy = STRATEGIES[name]
+    connection.send((0, name, None, 'ready', 0, 0.0))
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        job, cells, deadline, seed = message
+        watch = Watch(job, current, deadline)
+        start = time.perf_counter()
+        try:
+            solution = strategy(list(cells), random.Random(seed), watch)
+            status = 'solved' if solution else 'unsolvable'
+        except Cancelled:
+            solution, status = None, 'cancelled'
+        connection.send((job, name, solution, status, watch.nodes, time.perf_counter() - start))
+
+
+class Portfolio:
+    """
+    Races several solving strategies on every puzzle, one worker process per strategy, and returns the first
+    answer. As soon as one strategy solves the puzzle (or proves it has no solution) the others are cancelled, and
+    if none answers within the budget in seconds the solve gives up, so no puzzle can hold a caller for longer
+    than that. Strategies notice a cancel at their next search node; one that has not stopped GRACE seconds later
+    is killed and replaced before the next solve. The worker processes are started once, from a forkserver with
+    this module already imported, and reused for every solve. Not thread safe: give every thread its own
+    Portfolio.
+    """
+    def __init__(self, strategies=tuple(STRATEGIES), budget=BUDGET):
+        self.context = multiprocessing.get_context('forkserver')    # Forked workers would inherit the caller's files
+        self.context.set_forkserver_preload(['portfolio'])
+        self.current = self.context.Value('q', 0, lock=False)       # Job the workers should be solving, 0 for none
+        self.budget = budget
+        self.jobs = 0
+        self.workers = {}               # Strategy name -> (process, connection)
+        self.busy = {}                  # Connection -> strategy name, still answering a cancelled job
+        for name in strategies:
+            self.start(name)
+        for process, connection in self.workers.values():
+            connection.recv()           # Ready
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self, name):
+        """
+        Starts the worker process for a strategy.
+        """
+        ours, theirs = self.context.Pipe()
+        process = self.context.Process(target=worker, args=(name, theirs, self.current), name='portfolio-' + name,
+                                       daemon=True)
+        process.start()
+        theirs.close()
+        self.workers[name] = process, ours
+
+    def replace(self, name):
+        """
+        Kills a strategy's worker process and starts a new one.
+        """
+        process, connection = self.workers.pop(name)
+        process.kill()
+        process.join()
+        connection.close()
+        self.start(name)
+
+    def settle(self):
+        """
+        Waits for the strategies still busy with a cancelled job to answer, replacing any that take longer than
+        GRACE, so every worker is idle before the next job goes out.
+        """
+        deadline = time.monotonic() + GRACE
+        while self.busy:
+            ready = multiprocessing.connection.wait(list(self.busy), max(0.0, deadline - time.monotonic()))
+            if not ready:
+                break
+            for connection in ready:
+                name = self.busy.pop(connection)
+                try:
+                    connection.recv()
+                except EOFError:            # The worker died, start a new one
+                    self.replace(name)
+        for name in self.busy.values():
+            self.replace(name)
+        self.busy = {}
+
+    def solve(self, cells, budget=None, seed=None):
+        """
+        Solves a flat board (any size sudoku.solve_propagate takes) and returns a Result: the solution as a list (None
+        unless solved), the winning strategy, the status ('solved', 'unsolvable' or 'timeout'), the seconds taken
+        and the search nodes the winner visited. budget overrides the portfolio's budget for this solve and seed
+        fixes the random choices of the randomized strategies.
+        """
+        budget = self.budget if budget is None else budget
+        seed = random.randrange(1 << 32) if seed is None else seed
+        self.settle()
+        self.jobs += 1
+        self.current.value = self.jobs
+        start = time.monotonic()
+        deadline = start + budget
+        waiting = {}
+        for name, (process, connection) in self.workers.items():
+            connection.send((self.jobs, bytes(cells), deadline, seed))
+            waiting[connection] = name
+
+        result = None
+        try:
+            while waiting and result is None:
+                ready = multiprocessing.connection.wait(list(waiting), max(0.0, deadline - time.monotonic()))
+                if not ready:
+                    break
+                for connection in ready:
+                    name = waiting.pop(connection)
+                    try:
+                        job, name, solution, status, nodes, seconds = connection.recv()
+                    except EOFError:        # A crashed strategy just drops out of the race
+                        self.replace(name)
+                        continue
+                    if job != self.jobs:        # Ready from a replaced worker, its answer is still to come
+                        waiting[connection] = name
+                    elif status != 'cancelled' and result is None:
+                        result = Result(solution, name, status, time.monotonic() - start, nodes)
+        finally:
+            self.current.value = 0      # Cancels every strategy still running
+            self.busy = waiting
+        if result is None:
+            result = Result(None, None, 'timeout', time.monotonic() - start, 0)
+        return result
+
+    def close(self):
+        """
+        Stops every worker process.
+        """
+        self.current.value = 0
+        for process, connection in self.workers.values():
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process, connection in self.workers.values():
+            process.join(GRACE)
+            if process.is_alive():
+                process.kill()
+                process.join()
+            connection.close()
+        self.workers = {}
+        self.busy = {}
+
+
+def main(argv=None):
+    """
+    Command line entry point: solves every puzzle of a file through a Portfolio and writes one line per puzzle, the
+    solution, 'unsolvable' or 'timeout'. The wins of each strategy and the solve times are summed up on stderr.
+    """
+    parser = argparse.ArgumentParser(description='Race several solving strategies on every puzzle of a file.')
+    parser.add_argument('input', nargs='?', default='-', help='puzzle file, - for stdin (default)')
+    parser.add_argument('-o', '--output', default='-', help='solution file, - for stdout (default)')
+    parser.add_argument('-b', '--budget', type=float, default=BUDGET, help='seconds allowed per puzzle')
+    parser.add_argument('-s', '--strategies', nargs='+', choices=sorted(STRATEGIES), default=sorted(STRATEGIES))
+    parser.add_argument('--seed', type=int, default=None, help='seed for the randomized strategies')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    source = sys.stdin if args.input == '-' else open(args.input)
+    target = sys.stdout if args.output == '-' else open(args.output, 'w')
+    wins, times = collections.Counter(), []
+    try:
+        with Portfolio(args.strategies, args.budget) as portfolio:
+            for line in source:
+                cells = sudoku.parse_puzzle(line)
+                if cells is None:                   # Skip section markers and blank lines
+                    continue
+                result = portfolio.solve(cells, seed=rng.randrange(1 << 32))
+                wins[result.strategy or result.status] += 1
+                times.append(result.seconds)
+                target.write((sudoku.puzzle_text(result.solution) if result.solution else result.status) + '\n')
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    if times:
+        times.sort()
+        print('%d puzzles: p50 %.1f ms, p99 %.1f ms, max %.1f ms' % (
+            len(times), times[len(times) // 2] * 1000, times[min(len(times) - 1, int(0.99 * len(times)))] * 1000,
+            times[-1] * 1000), file=sys.stderr)
+        print('Wins: ' + ', '.join('%s %d' % item for item in wins.most_common()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Author: Joseph Caswell
+# Project: Sudoku puzzle prefetching
+
+import concurrent.futures
+import queue
+import threading
+import sudoku
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+
+def make_puzzle(diff, stats=None, box=3, seed=None):
+    """
+    Builds one game of the given difficulty the same way the GUI always has: a board from the puzzle file, shuffled
+    and solved. Returns (puzzle, solution, board ID) with the boards as byte strings. With a sudoku.SolveStats the
+    load, shuffle, solve and validate phases are timed and the solver's work is counted. box picks the board size
+    and seed the board's random seed (see sudoku.Board).
+    """
+    game = sudoku.Board(diff, box, seed)
+    if stats is None:
+        game.create()
+        return bytes(game.board.cells), bytes(game.solved.cells), game.id
+
+    rng = game.random()
+    with stats.phase('load'):
+        game.difficulty(rng)
+    with stats.phase('shuffle'):
+        game.shuffle_board(rng=rng)
+    game.solve(stats=stats)
+    with stats.phase('validate'):
+        stats.extra['valid'] = sudoku.valid_board(game.solved)
+    return bytes(game.board.cells), bytes(game.solved.cells), game.id
+
+
+class PuzzlePool:
+    """
+    Keeps a bounded queue of ready games for each difficulty and refills it from a background thread, so a new game
+    is a queue pop instead of a load, shuffle and solve. With processes > 0 the puzzles are built in a pool of
+    worker processes instead of the background thread itself. If a queue has run dry get() builds a puzzle on the
+    spot rather than wait. make builds one game from a difficulty, by default the (puzzle, solution, board ID) of
+    make_puzzle, and can be swapped for any other source (it must be picklable to use processes).
+    """
+    def __init__(self, difficulties=DIFFICULTIES, size=4, processes=0, make=make_puzzle):
+        self.queues = {diff: queue.Queue(size) for diff in difficulties}
+        self.make = make
+        self.executor = concurrent.futures.ProcessPoolExecutor(processes) if processes else None
+        self.wake = threading.Event()           # Set whenever a puzzle is taken
+        self.stopped = False
+        self.thread = threading.Thread(target=self.fill, name='puzzle-pool', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fill(self):
+        """
+        Background loop: tops up every queue that has room, then sleeps until a puzzle is taken.
+        """
+        while not self.stopped:
+            for diff, ready in self.queues.items():
+                missing = ready.maxsize - ready.qsize()
+                if missing <= 0:
+                    continue
+                if self.executor is None:
+                    games = (self.make(diff) for _ in range(missing))
+                else:
+                    games = self.executor.map(self.make, [diff] * missing)
+                for game in games:
+                    if self.stopped:
+                        return
+                    ready.put(game)             # Only this thread adds puzzles, so there is room
+            self.wake.wait()
+            self.wake.clear()
+
+    def get(self, diff):
+        """
+        Returns a ready game for the difficulty and wakes the background thread to replace it.
+        """
+        try:
+            game = self.queues[diff].get_nowait()
+        except queue.Empty:                     # Pool ran dry, build one now
+            game = self.make(diff)
+        self.wake.set()
+        return game
+
+    def ready(self, diff):
+        """
+        Number of puzzles waiting for the difficulty.
+        """
+        return self.queues[diff].qsize()
+
+    def close(self):
+        """
+        Stops the background thread and any worker processes.
+        """
+        self.stopped = True
+        self.wake.set()
+        self.thread.join()
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,363 @@
+# Author: Joseph Caswell
+# Project: Sudoku puzzle store
+
+import argparse
+import mmap
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+from functools import lru_cache
+
+BOARDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'boards.txt')
+CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'sudoku')
+DIFFICULTIES = ('easy', 'medium', 'hard')       # Section order used by boards.txt
+MAGIC = b'SUDOKUPZ'                             # Stores with one byte per cell, still readable
+PACKED_MAGIC = b'SUDOKUP4'                      # Stores with four bits per cell, written by write() and ingest()
+HEADER = struct.Struct('<8sI')                  # Magic, number of sections (index entries in packed stores)
+SECTION = struct.Struct('<16sQQ')               # Difficulty name, first record, record count
+INDEX = struct.Struct('<16sIQQ')                # Difficulty name, rating score, first record, record count
+RECORD = 81                                     # One byte per cell
+PACKED = 41                                     # Two cells per byte, the last low half unused
+SPILL = 1 << 26                                 # Bytes of records ingest() buffers before spilling to disk
+CELL_VALUES = bytes.maketrans(b'.0123456789ABCDEFGHIJKLMNOPabcdefghijklmnop',   # Letters are 10 - 25 on big boards
+                              bytes([0]) + bytes(range(10)) + bytes(range(10, 26)) * 2)
+SYMBOLS = bytes.maketrans(bytes(range(26)), b'0123456789ABCDEFGHIJKLMNOP')
+HIGH_HALF = bytes(value >> 4 for value in range(256))
+LOW_HALF = bytes(value & 15 for value in range(256))
+SHIFTED = bytes((value << 4) & 255 for value in range(256))
+
+
+def pack(cells):
+    """
+    Packs 81 cell values into 41 bytes, the first cell of each pair in the high four bits.
+    """
+    cells = bytes(cells) + b'\0'
+    high = int.from_bytes(cells[0::2].translate(SHIFTED), 'big')
+    return (high | int.from_bytes(cells[1::2], 'big')).to_bytes(PACKED, 'big')
+
+
+def unpack(record):
+    """
+    Returns the 81 cell values of a packed record as bytes. Both halves are split out with a lookup table, so
+    there is no loop over the cells.
+    """
+    record = bytes(record)
+    cells = bytearray(2 * PACKED)
+    cells[0::2] = record.translate(HIGH_HALF)
+    cells[1::2] = record.translate(LOW_HALF)
+    return bytes(cells[:RECORD])
+
+
+class PuzzleStore:
+    """
+    Indexed collection of puzzles grouped by difficulty, and within a difficulty by rating score (see rating.rate;
+    puzzles that were never rated score 0). Every puzzle is a fixed size record and the records are sorted by
+    difficulty and score, so a puzzle, or every puzzle in a range of scores, is found by offset alone. A store is
+    either parsed once from a text file like boards.txt, with one byte per cell, or backed by a memory mapped binary
+    file written by write() or ingest(), with four bits per cell. Reads from a mapped store slice the map directly;
+    nothing is loaded up front beyond the header.
+    """
+    def __init__(self, data, ratings, width=RECORD):
+        self.data = data            # Concatenated puzzle records (bytes, mmap or memoryview)
+        self.width = width          # Bytes per record, RECORD or PACKED
+        self.ratings = {}           # Difficulty -> [(score, first record, record count)] by score
+        self.sections = {}          # Difficulty -> (first record, record count)
+        for name, entries in ratings.items():
+            self.ratings[name] = [entry for entry in entries if entry[2]]
+            start = entries[0][1] if entries else 0
+            self.sections[name] = (start, sum(count for score, first, count in entries))
+
+    @classmethod
+    def from_text(cls, path=BOARDS):
+        """
+        Parses a text file with one 81 character puzzle per line ('0' or '.' for empty cells). A quoted marker line
+        such as 'easy' ends the section of that difficulty and the following puzzles belong to the next one.
+        """
+        found = {name: [] for name in DIFFICULTIES}
+        section = 0
+        with open(path, 'rb') as file:
+            for line in file:
+                line = line.strip()
+                name = line.strip(b'\'"').decode()
+                if name in found:                       # Section marker
+                    section = min(DIFFICULTIES.index(name) + 1, len(DIFFICULTIES) - 1)
+                elif len(line) == RECORD:
+                    found[DIFFICULTIES[section]].append(line.translate(CELL_VALUES))
+
+        ratings = {}
+        start = 0
+        for name in DIFFICULTIES:
+            ratings[name] = [(0, start, len(found[name]))]
+            start += len(found[name])
+        return cls(b''.join(b''.join(found[name]) for name in DIFFICULTIES), ratings)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Opens a binary store written by write() or ingest(), or by older versions with one byte per cell. The records
+        are memory mapped, so only the header is read up front and the operating system pages puzzles in as they
+        are used.
+        """
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(data, 0)
+        if magic not in (MAGIC, PACKED_MAGIC):
+            data.close()
+            raise ValueError(path + ' is not a puzzle store')
+
+        ratings = {}
+        offset = HEADER.size
+        for index in range(count):
+            if magic == MAGIC:
+                name, start, size = SECTION.unpack_from(data, offset)
+                score = 0
+                offset += SECTION.size
+            else:
+                name, score, start, size = INDEX.unpack_from(data, offset)
+                offset += INDEX.size
+            ratings.setdefault(name.rstrip(b'\0').decode(), []).append((score, start, size))
+        return cls(memoryview(data)[offset:], ratings, RECORD if magic == MAGIC else PACKED)
+
+    def write(self, path):
+        """
+        Saves the store in the packed binary format read by open(): a header indexing the records by difficulty and
+        score followed by the records at four bits per cell.
+        """
+        entries = [(name,) + entry for name, group in self.ratings.items() for entry in group]
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(PACKED_MAGIC, len(entries)))
+            for name, score, start, size in entries:
+                file.write(INDEX.pack(name.encode(), score, start, size))
+            if self.width == PACKED:
+                file.write(self.data)
+                return
+            for number in range(0, len(self.data) // RECORD, 4096):     # Pack a block of records at a time
+                block = self.data[number * RECORD:(number + 4096) * RECORD]
+                file.write(b''.join(pack(block[offset:offset + RECORD]) for offset in range(0, len(block), RECORD)))
+
+    def export(self, output):
+        """
+        Writes every puzzle as an 81 character line, each difficulty followed by its quoted marker line, the layout
+        from_text() reads. Every marker is written, even for a difficulty without puzzles, since from_text() places
+        puzzles by the markers before them.
+        """
+        for name in DIFFICULTIES:
+            for index in range(self.count(name) if name in self.sections else 0):
+                output.write(self.get(name, index).translate(SYMBOLS).decode() + '\n')
+            output.write("'" + name + "'\n")
+
+    def count(self, diff):
+        """
+        Number of puzzles of the given difficulty.
+        """
+        return self.sections[diff][1]
+
+    def record(self, number):
+        """
+        Returns record number of the store as 81 bytes of cell values.
+        """
+        offset = number * self.width
+        if self.width == PACKED:
+            return unpack(self.data[offset:offset + PACKED])
+        return bytes(self.data[offset:offset + RECORD])
+
+    def view(self, diff):
+        """
+        Returns the raw records of a difficulty as a memoryview of the store, without copying them.
+        """
+        start, size = self.sections[diff]
+        return memoryview(self.data)[start * self.width:(start + size) * self.width]
+
+    def get(self, diff, index):
+        """
+        Returns puzzle number index of the given difficulty as 81 bytes.
+        """
+        start, size = self.sections[diff]
+        if not 0 <= index < size:
+            raise IndexError('no ' + diff + ' puzzle ' + str(index))
+        return self.record(start + index)
+
+    def span(self, diff, low, high):
+        """
+        Returns the first record and the record after the last of the puzzles of a difficulty scoring from low to
+        high inclusive. They are next to each other because records are sorted by score.
+        """
+        entries = [(first, first + count) for score, first, count in self.ratings[diff] if low <= score <= high]
+        if not entries:
+            return 0, 0
+        return entries[0][0], entries[-1][1]
+
+    def random(self, diff, rng=None, rating=None):
+        """
+        Returns a random puzzle of the given difficulty, or with rating as (low, high) a random one of those scoring
+        in that range.
+        """
+        rng = rng or random
+        if rating is None:
+            return self.get(diff, rng.randrange(self.count(diff)))
+        first, end = self.span(diff, *rating)
+        if first == end:
+            raise IndexError('no %s puzzle rated %d - %d' % ((diff,) + tuple(rating)))
+        return self.record(rng.randrange(first, end))
+
+
+def ingest(lines, path, diff=None, jobs=None, spill=SPILL):
+    """
+    Streams a text dump with one 81 character puzzle per line ('0' or '.' for empty cells, other lines are skipped)
+    into a packed store at path, in bounded memory however many puzzles there are. Every puzzle is rated across jobs
+    worker processes (see rating.rate_file) and filed under its difficulty and score, dropping unsolvable ones. With
+    diff nothing is rated and every puzzle gets that difficulty and a score of 0, which is far faster. Records are
+    grouped in memory and appended to temporary files next to path whenever spill bytes are waiting, then copied in
+    order behind the index. Returns the number of puzzles of each difficulty.
+    """
+    import rating                               # rating and sudoku import this module, so load them late
+    import sudoku
+
+    lines = (line for line in lines if len(line.strip()) == RECORD)
+    if diff is None:
+        puzzles = ((rated.difficulty, rated.score, cells)
+                   for number, cells, rated in rating.rate_file(lines, jobs) if rated is not None)
+    else:
+        puzzles = ((diff, 0, cells) for cells in map(sudoku.parse_puzzle, lines) if cells is not None)
+
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    groups = {}                                 # (difficulty, score) -> records not spilled yet
+    counts = {}                                 # (difficulty, score) -> number of records
+    try:
+        waiting = 0
+        for name, score, cells in puzzles:
+            key = (name, score)
+            groups.setdefault(key, bytearray()).extend(pack(cells))
+            counts[key] = counts.get(key, 0) + 1
+            waiting += PACKED
+            if waiting >= spill:
+                spill_groups(directory, groups)
+                waiting = 0
+        spill_groups(directory, groups)
+
+        rank = {name: index for index, name in enumerate(DIFFICULTIES)}
+        order = sorted(counts, key=lambda key: (rank.get(key[0], len(rank)), key))
+        with open(temporary, 'wb') as file:
+            file.write(HEADER.pack(PACKED_MAGIC, len(order)))
+            start = 0
+            for name, score in order:
+                file.write(INDEX.pack(name.encode(), score, start, counts[name, score]))
+                start += counts[name, score]
+            for key in order:
+                with open(os.path.join(directory, '%s-%d' % key), 'rb') as group:
+                    shutil.copyfileobj(group, file)
+        os.replace(temporary, path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+    totals = {}
+    for (name, score), count in counts.items():
+        totals[name] = totals.get(name, 0) + count
+    return totals
+
+
+def spill_groups(directory, groups):
+    """
+    Appends the waiting records of each (difficulty, score) group to its file in directory and empties groups.
+    """
+    for key, records in groups.items():
+        with open(os.path.join(directory, '%s-%d' % key), 'ab') as file:
+            file.write(records)
+    groups.clear()
+
+
+class GameCache:
+    """
+    Small on-disk cache of built games keyed by board ID, so asking for the same seeded board again (a shared link or
+    the puzzle of the day) skips generating it. Each game is one file holding the puzzle followed by its solution.
+    Files are written to a temporary name and renamed into place, so several processes can share a directory, and
+    the oldest files are removed once there are more than maxsize.
+    """
+    def __init__(self, directory=CACHE, maxsize=1000):
+        self.directory = directory
+        self.maxsize = maxsize
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, board_id):
+        return os.path.join(self.directory, board_id + '.game')
+
+    def get(self, board_id):
+        """
+        Returns the (puzzle, solution) stored for a board ID as byte strings, or None if it is not cached.
+        """
+        try:
+            with open(self.path(board_id), 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        half = len(data) // 2
+        if not half or half * 2 != len(data):           # Damaged file, treat as missing
+            return None
+        return data[:half], data[half:]
+
+    def put(self, board_id, puzzle, solution):
+        """
+        Stores a game under its board ID.
+        """
+        target = self.path(board_id)
+        temporary = '%s.%d.tmp' % (target, os.getpid())
+        with open(temporary, 'wb') as file:
+            file.write(bytes(puzzle) + bytes(solution))
+        os.replace(temporary, target)
+        self.prune()
+
+    def prune(self):
+        """
+        Removes the least recently written games beyond maxsize.
+        """
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.game')]
+        if len(entries) <= self.maxsize:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.maxsize]:
+            try:
+                os.remove(entry.path)
+            except OSError:                             # Already removed by another process
+                pass
+
+
+@lru_cache(maxsize=None)
+def load(path=BOARDS):
+    """
+    Returns the store for a puzzle file, parsing it only the first time it is asked for. Binary stores are
+    recognized by their header, anything else is read as text.
+    """
+    with open(path, 'rb') as file:
+        binary = file.read(len(MAGIC)) in (MAGIC, PACKED_MAGIC)
+    return PuzzleStore.open(path) if binary else PuzzleStore.from_text(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert puzzle files to and from memory mappable binary stores.')
+    parser.add_argument('source', help='puzzle file with one puzzle per line (- for stdin), or a store to export')
+    parser.add_argument('target', help='binary store to write (text file with --export)')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--rate', action='store_true', help='stream the puzzles in and file them by rating')
+    group.add_argument('--difficulty', choices=DIFFICULTIES, help='stream the puzzles in as one difficulty')
+    group.add_argument('--export', action='store_true', help='write a store back out as text')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='rating processes (default: all cores)')
+    args = parser.parse_args()
+
+    if args.export:
+        with open(args.target, 'w') as output:
+            load(args.source).export(output)
+    elif args.rate or args.difficulty:
+        source = sys.stdin if args.source == '-' else open(args.source)
+        with source:
+            totals = ingest(source, args.target, args.difficulty, args.jobs)
+        print(', '.join(name + ': ' + str(count) for name, count in totals.items()))
+    else:
+        store = PuzzleStore.from_text(args.source)
+        store.write(args.target)
+        print(', '.join(name + ': ' + str(store.count(name)) for name in store.sections))
@@ -0,0 +1,419 @@
+# Author: Joseph Caswell
+# Project: Sudoku difficulty rating
+
+import argparse
+import collections
+import functools
+import itertools
+import multiprocessing
+import os
+import sys
+import threading
+import sudoku
+
+LEVELS = ('easy', 'medium', 'hard')
+
+Rating = collections.namedtuple('Rating', 'score difficulty hardest steps counts')
+Hint = collections.namedtuple('Hint', 'cell digit technique')
+
+
+class Candidates:
+    """
+    Pencil marks for a board being solved by hand: the cell values plus, for every empty cell, the bitmask of digits
+    that are still possible there (bit 1 << (digit - 1)). Techniques place digits with place() and remove candidates
+    with eliminate(), and both keep the peers' masks up to date. shape is the board's sudoku.Geometry. cand can pass
+    in masks that are already known (such as the GUI's pencil marks) instead of working them out from the cells.
+    """
+    __slots__ = ('cells', 'cand', 'empty', 'shape')
+
+    def __init__(self, cells, shape=sudoku.NINE, cand=None):
+        self.cells = list(cells)
+        self.shape = shape
+        self.empty = self.cells.count(0)
+        if cand is not None:
+            self.cand = list(cand)
+            return
+        self.cand = [0] * shape.cells
+        used = sudoku.unit_masks(self.cells) or [shape.all_digits] * len(shape.units)     # Clashes leave nothing
+        for cell in range(shape.cells):
+            if not self.cells[cell]:
+                row, col, box = shape.cell_units[cell]
+                self.cand[cell] = shape.all_digits & ~(used[row] | used[col] | used[box])
+
+    def place(self, cell, bit):
+        """
+        Writes the digit for bit into cell and removes it from the candidates of every peer.
+        """
+        self.cells[cell] = self.shape.bit_digit[bit]
+        self.cand[cell] = 0
+        self.empty -= 1
+        cand = self.cand
+        for peer in self.shape.peers[cell]:
+            cand[peer] &= ~bit
+
+    def eliminate(self, cells, bits):
+        """
+        Removes the candidate bits from each of cells and returns how many cells lost a candidate.
+        """
+        removed = 0
+        cand = self.cand
+        for cell in cells:
+            if cand[cell] & bits:
+                cand[cell] &= ~bits
+                removed += 1
+        return removed
+
+    def broken(self):
+        """
+        True if an empty cell has run out of candidates.
+        """
+        return any(not value and not mask for value, mask in zip(self.cells, self.cand))
+
+
+def naked_singles(grid):
+    """
+    Places every cell that has exactly one candidate left.
+    """
+    placed = 0
+    cand = grid.cand
+    for cell in range(grid.shape.cells):
+        mask = cand[cell]
+        if mask and not mask & (mask - 1):
+            grid.place(cell, mask)
+            placed += 1
+    return placed
+
+
+def hidden_singles(grid):
+    """
+    Places digits that have only one possible cell left in a row, column or box.
+    """
+    placed = 0
+    cand = grid.cand
+    for members in grid.shape.units:
+        once = twice = 0
+        for cell in members:
+            twice |= once & cand[cell]
+            once |= cand[cell]
+        once &= ~twice
+        while once:
+            bit = once & -once
+            once ^= bit
+            for cell in members:
+                if cand[cell] & bit:
+                    grid.place(cell, bit)
+                    placed += 1
+                    break
+    return placed
+
+
+def naked_pairs(grid):
+    """
+    Two cells of a unit with the same two candidates hold those digits between them, so no other cell of the unit
+    can.
+    """
+    removed = 0
+    cand = grid.cand
+    for members in grid.shape.units:
+        seen = {}
+        for cell in members:
+            mask = cand[cell]
+            if grid.shape.bit_count[mask] == 2:
+                if mask in seen:
+                    others = [other for other in members if other != cell and other != seen[mask]]
+                    removed += grid.eliminate(others, mask)
+                else:
+                    seen[mask] = cell
+    return removed
+
+
+def hidden_pairs(grid):
+    """
+    Two digits confined to the same two cells of a unit must fill them, so those cells lose every other candidate.
+    """
+    removed = 0
+    cand = grid.cand
+    for members in grid.shape.units:
+        places = {}
+        present = 0
+        for cell in members:
+            present |= cand[cell]
+        for bit in grid.shape.bit_digit:
+            if not present & bit:                   # Placed in this unit already
+                continue
+            where = tuple(cell for cell in members if cand[cell] & bit)
+            if len(where) == 2:
+                places.setdefault(where, []).append(bit)
+        for where, bits in places.items():
+            if len(bits) == 2:
+                pair = bits[0] | bits[1]
+                removed += grid.eliminate(where, grid.shape.all_digits & ~pair)
+    return removed
+
+
+def locked_candidates(grid, boxes_first):
+    """
+    Shared search for pointing pairs (boxes_first is True: a digit whose cells in a box all share a row or column
+    is removed from the rest of that line) and box-line reduction (boxes_first is False: a digit whose cells in a
+    row or column all share a box is removed from the rest of that box).
+    """
+    removed = 0
+    cand = grid.cand
+    units, cell_units, lines = grid.shape.units, grid.shape.cell_units, 2 * grid.shape.size
+    for members in (units[lines:] if boxes_first else units[:lines]):
+        present = 0
+        for cell in members:
+            present |= cand[cell]
+        for bit in grid.shape.bit_digit:
+            if not present & bit:                   # Placed in this unit already
+                continue
+            where = [cell for cell in members if cand[cell] & bit]
+            if len(where) < 2:
+                continue
+            shared = set(cell_units[where[0]])
+            for cell in where[1:]:
+                shared.intersection_update(cell_units[cell])
+                if len(shared) == 1:                # Only the unit itself
+                    break
+            for unit in shared:
+                if (unit >= lines) != boxes_first:  # Target the other kind of unit
+                    others = [cell for cell in units[unit] if cell not in where]
+                    removed += grid.eliminate(others, bit)
+    return removed
+
+
+def fish(grid, size):
+    """
+    X-Wing (size 2) and Swordfish (size 3): if a digit's places in size rows all fall in the same size columns, it
+    must occupy those columns in exactly those rows and is removed from the rest of the columns. The same holds with
+    rows and columns swapped.
+    """
+    removed = 0
+    cand = grid.cand
+    units, count, size_of = grid.shape.units, grid.shape.size, grid.shape.bit_count
+    rows, cols = units[:count], units[count:2 * count]
+    for bit in grid.shape.bit_digit:
+        for lines, crosses in ((rows, cols), (cols, rows)):
+            spots = []                              # (line, bitmask of crossing positions) with 2..size places
+            for index, members in enumerate(lines):
+                mask = 0
+                for position, cell in enumerate(members):
+                    if cand[cell] & bit:
+                        mask |= 1 << position
+                if 2 <= size_of[mask] <= size:
+                    spots.append((index, mask))
+            for group in itertools.combinations(spots, size):
+                union = 0
+                for index, mask in group:
+                    union |= mask
+                if size_of[union] != size:
+                    continue
+                chosen = set(index for index, mask in group)
+                for position in range(count):
+                    if union & (1 << position):
+                        others = [cell for index, cell in enumerate(crosses[position]) if index not in chosen]
+                        removed += grid.eliminate(others, bit)
+    return removed
+
+
+TECHNIQUES = (                                      # Name, weight and step function, easiest first
+    ('naked single', 1, naked_singles),
+    ('hidden single', 2, hidden_singles),
+    ('pointing pair', 4, functools.partial(locked_candidates, boxes_first=True)),
+    ('box-line reduction', 5, functools.partial(locked_candidates, boxes_first=False)),
+    ('naked pair', 6, naked_pairs),
+    ('hidden pair', 7, hidden_pairs),
+    ('x-wing', 10, functools.partial(fish, size=2)),
+    ('swordfish', 12, functools.partial(fish, size=3)),
+)
+BACKTRACKING = ('backtracking', 20)
+
+
+def difficulty(weight):
+    """
+    Maps the weight of the hardest technique used onto the board difficulties: singles only is easy, pairs and
+    locked candidates are medium, fish and guessing are hard.
+    """
+    if weight <= 2:
+        return 'easy'
+    if weight <= 7:
+        return 'medium'
+    return 'hard'
+
+
+def rate(cells):
+    """
+    Rates a flat puzzle (any size sudoku.parse_puzzle reads) by solving it the way a person would. At every step the easiest technique that makes
+    progress is applied, and backtracking is used only when none of them do. The score is the weight of the hardest
+    technique times 100 plus the number of steps taken. Returns None if the puzzle cannot be solved, including a
+    full board whose digits clash.
+    """
+    if sudoku.unit_masks(cells) is None:
+        return None
+    grid = Candidates(cells, sudoku.board_geometry(len(cells)))
+    counts = dict.fromkeys([name for name, weight, step in TECHNIQUES], 0)
+    hardest, weight, steps = None, 0, 0
+    while grid.empty:
+        if grid.broken():
+            return None
+        for name, cost, step in TECHNIQUES:
+            if step(grid):
+                counts[name] += 1
+                steps += 1
+                if cost > weight:
+                    hardest, weight = name, cost
+                break
+        else:                                       # No technique applies, finish by search
+            if sudoku.solve_propagate(grid.cells) is None:
+                return None
+            hardest, weight = BACKTRACKING
+            counts[hardest] = 1
+            steps += 1
+            break
+    return Rating(weight * 100 + steps, difficulty(weight), hardest, steps, counts)
+
+
+def find_single(grid):
+    """
+    Returns (cell, bit, technique) for the first naked single or, failing that, the first hidden single, without
+    placing it. None if there is neither.
+    """
+    cand = grid.cand
+    for cell, mask in enumerate(cand):
+        if mask and not mask & (mask - 1):
+            return cell, mask, 'naked single'
+    for members in grid.shape.units:
+        once = twice = 0
+        for cell in members:
+            twice |= once & cand[cell]
+            once |= cand[cell]
+        once &= ~twice
+        if once:
+            bit = once & -once
+            for cell in members:
+                if cand[cell] & bit:
+                    return cell, bit, 'hidden single'
+    return None
+
+
+def trial(grid, cell):
+    """
+    Tries each candidate of cell in turn, propagating singles after it with sudoku.propagate. Returns the digit if
+    that settles the cell, because the digit finishes the board or every other candidate runs into a
+    contradiction, and None if it does not.
+    """
+    shape = grid.shape
+    used = sudoku.unit_masks(grid.cells)
+    alive = []
+    for bit in shape.bit_digit:
+        if grid.cand[cell] & bit:
+            cells, masks = grid.cells[:], used[:]
+            cells[cell] = shape.bit_digit[bit]
+            for unit in shape.cell_units[cell]:
+                masks[unit] |= bit
+            left = sudoku.propagate(cells, masks, shape)
+            if left == -1:                          # Solved outright
+                return cells[cell]
+            if left is not None:
+                alive.append(cells[cell])
+    return alive[0] if len(alive) == 1 else None
+
+
+def next_step(cells, cand=None, shape=None, solve=sudoku.solve_propagate):
+    """
+    Finds the easiest next deduction on a board in progress, of any size, and returns it as a Hint: the cell, its
+    digit and the technique that justifies it. Singles are looked for first. When there are none, the elimination
+    techniques are applied from easiest to hardest on a copy of the candidates until a single turns up, and the
+    hardest technique that was needed is the one reported. cand can pass in candidate masks kept up to date by the
+    caller (such as Grid.candidates) to save working them out. When no technique gets anywhere the hint is the most
+    constrained cell: settled by trial when one candidate is left standing ('trial and error'), and otherwise read
+    from solve(cells) ('backtracking'), a full search unless the caller already has the solution to hand. Returns
+    None if the board is full or has no solution.
+    """
+    shape = shape or sudoku.board_geometry(len(cells))
+    grid = Candidates(cells, shape, cand)
+    hardest, weight = None, 0
+    while grid.empty and not grid.broken():
+        found = find_single(grid)
+        if found is not None:
+            cell, bit, technique = found
+            return Hint(cell, shape.bit_digit[bit], hardest or technique)
+        for name, cost, step in TECHNIQUES[2:]:     # Eliminations only, the singles were just looked for
+            if step(grid):
+                if cost > weight:
+                    hardest, weight = name, cost
+                break
+        else:                                       # Nothing logical left, guess on the most constrained cell
+            cell = min((cell for cell in range(shape.cells) if not grid.cells[cell]),
+                       key=lambda cell: shape.bit_count[grid.cand[cell]])
+            digit = trial(grid, cell)
+            if digit is not None:
+                return Hint(cell, digit, 'trial and error')
+            solution = solve(grid.cells)
+            if solution is None:
+                return None
+            return Hint(cell, solution[cell], BACKTRACKING[0])
+    return None
+
+
+def generate_rated(diff, rng=None, attempts=100):
+    """
+    Generates a puzzle whose rating matches diff ('easy', 'medium' or 'hard') and returns it with its solution.
+    Clues are removed for as long as the puzzle stays rated no harder than that, and a removal that would push it
+    above is put back, so an easy puzzle is as sparse as an easy puzzle from that board gets. Attempts that end up
+    rated below diff are thrown away.
+    """
+    target = LEVELS.index(diff)
+
+    def easy_enough(puzzle):
+        rating = rate(puzzle)
+        return rating is not None and LEVELS.index(rating.difficulty) <= target
+
+    for attempt in range(attempts):
+        puzzle, solution = sudoku.generate_puzzle(rng=rng, keep=easy_enough)
+        rating = rate(puzzle)
+        if rating is not None and rating.difficulty == diff:
+            return puzzle, solution
+    raise RuntimeError('no ' + diff + ' puzzle found in ' + str(attempts) + ' attempts')
+
+
+def rate_lines(chunk):
+    """
+    Rates a chunk of (line number, puzzle) pairs for rate_file's workers.
+    """
+    return [(number, cells, rate(cells)) for number, cells in chunk]
+
+
+def rate_file(lines, jobs=None, chunksize=64):
+    """
+    Rates every puzzle line of a stream across a pool of worker processes. Yields (line number, cells, rating) in
+    input order, with a rating of None for unsolvable puzzles. Like the batch solver, only a bounded number of
+    chunks are read ahead.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    slots = threading.Semaphore(jobs * 4)
+    chunks = sudoku.read_chunks(lines, chunksize, slots)
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        for result in (pool.imap(rate_lines, chunks) if pool else map(rate_lines, chunks)):
+            slots.release()
+            yield from result
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rate the puzzles in a file by the techniques needed to solve them.')
+    parser.add_argument('input', nargs='?', default=sudoku.puzzles.BOARDS, help='puzzle file, - for stdin')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    with source:
+        for number, cells, rating in rate_file(source, args.jobs):
+            line = ''.join(map(str, cells))
+            if rating is None:
+                print(line, 'unsolvable')
+            else:
+                print(line, rating.score, rating.difficulty, rating.hardest, rating.steps)
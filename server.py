@@ -0,0 +1,346 @@
+# Author: Joseph Caswell
+# Project: Sudoku puzzle service
+
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import random
+import urllib.parse
+import prefetch
+import puzzles
+import sudoku
+
+MAX_HEADER = 16384                  # Largest request head accepted, in bytes
+MAX_BODY = 16 * 1024 * 1024         # Largest request body accepted, in bytes
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           422: 'Unprocessable Entity'}
+
+
+class RequestError(Exception):
+    """
+    Raised by a handler to answer with an error status and message.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def read_board(value):
+    """
+    Accepts a board as an 81 character string ('0' or '.' for empty cells), a flat list of 81 numbers or nested
+    9x9 lists, and returns its cell values as bytes.
+    """
+    if isinstance(value, str):
+        cells = sudoku.parse_puzzle(value)
+        if cells is not None and len(cells) != 81:      # parse_puzzle also takes the other board sizes
+            cells = None
+    elif isinstance(value, list) and len(value) == 9 and all(isinstance(row, list) for row in value):
+        cells = read_board(sudoku.flatten(value)) if all(len(row) == 9 for row in value) else None
+    elif isinstance(value, list) and len(value) == 81 and all(isinstance(cell, int) for cell in value):
+        cells = bytes(value) if all(0 <= cell <= 9 for cell in value) else None
+    else:
+        cells = None
+    if cells is None:
+        raise RequestError(400, 'expected a board of 81 cells')
+    return cells
+
+
+def board_text(cells):
+    """
+    Formats cell values as an 81 character string.
+    """
+    return ''.join(map(str, cells))
+
+
+def unsolved_puzzle(diff):
+    """
+    Draws and shuffles a puzzle without solving it, since the service never hands out solutions with puzzles.
+    Returns (puzzle, None, board ID) in the shape prefetch.PuzzlePool expects.
+    """
+    game = sudoku.Board(diff)
+    rng = game.random()
+    game.difficulty(rng)
+    game.shuffle_board(rng=rng)
+    return bytes(game.board.cells), None, game.id
+
+
+def seeded_puzzle(board_id, day, diff, cache):
+    """
+    Rebuilds the game for a board ID, or the puzzle of the day when board_id is None, in a worker process. Returns
+    (puzzle, board ID).
+    """
+    if board_id is None:
+        game = sudoku.Board.daily(diff, day, cache=cache)
+    else:
+        game = sudoku.Board.from_id(board_id, cache)
+    return bytes(game.board.cells), game.id
+
+
+def solve_many(puzzles):
+    """
+    Solves a list of puzzles in a worker process, returning None for each one without a solution.
+    """
+    return [sudoku.solve_propagate(cells) for cells in puzzles]
+
+
+class PuzzleService:
+    """
+    Small HTTP/1.1 JSON service on top of sudoku.Board, served with asyncio streams so one process handles many
+    keep-alive connections. Puzzles come from a prefetch.PuzzlePool and solving is sent to a process pool so the
+    event loop only ever parses and routes requests. Solve requests that arrive in the same pass of the event loop
+    are sent to the workers together, which saves a round trip per puzzle under load.
+
+    GET  /puzzle?difficulty=easy    {"puzzle": ..., "difficulty": ..., "id": ...}
+    GET  /puzzle?id=9-easy-1f3c     The same puzzle again, rebuilt from its board ID
+    GET  /daily?difficulty=easy     Puzzle of the day, the same from every server
+    POST /solve                     {"puzzle": ...} -> {"solution": ...}
+    POST /validate                  {"board": ...} -> {"valid": ...}
+    POST /hint                      {"board": ...} -> {"row": ..., "col": ..., "value": ...}
+    POST /batch/solve               {"puzzles": [...]} -> {"solutions": [...]}, null where unsolvable
+    """
+    def __init__(self, workers=None, chunksize=64, prepared=256, cache=None):
+        context = multiprocessing.get_context('forkserver')   # Forked workers would hold open client sockets
+        self.executor = concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count(), mp_context=context)
+        self.pool = prefetch.PuzzlePool(size=prepared, make=unsolved_puzzle)
+        self.cache = cache                  # puzzles.GameCache for seeded boards, shared with the workers
+        self.chunksize = chunksize          # Puzzles per worker task
+        self.pending = []                   # (cells, future) waiting to be sent to the workers
+        self.routes = {
+            ('GET', '/puzzle'): self.puzzle,
+            ('GET', '/daily'): self.daily,
+            ('POST', '/solve'): self.solve,
+            ('POST', '/validate'): self.validate,
+            ('POST', '/hint'): self.hint,
+            ('POST', '/batch/solve'): self.batch_solve,
+        }
+
+    async def run(self, host='127.0.0.1', port=8080):
+        """
+        Serves requests until cancelled.
+        """
+        server = await asyncio.start_server(self.connection, host, port, limit=MAX_HEADER)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """
+        Shuts down the puzzle pool and worker processes.
+        """
+        self.pool.close()
+        self.executor.shutdown(cancel_futures=True)
+
+    async def connection(self, reader, writer):
+        """
+        Handles every request on one connection, keeping it open between requests unless the client asks to close.
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, 413, {'error': 'request head too large'}, False)
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'malformed request line'}, False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+                length = headers.get('content-length', '0') or '0'
+                if not length.isdigit():
+                    await self.respond(writer, 400, {'error': 'invalid Content-Length'}, False)
+                    break
+                length = int(length)
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {'error': 'request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, payload = await self.dispatch(method, target, body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        """
+        Writes one JSON response.
+        """
+        body = json.dumps(payload).encode()
+        head = ('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n'
+                % (status, REASONS[status], len(body), 'keep-alive' if keep_alive else 'close'))
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    async def dispatch(self, method, target, body):
+        """
+        Routes a request to its handler and turns errors into JSON error responses.
+        """
+        url = urllib.parse.urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for verb, path in self.routes):
+                return 405, {'error': method + ' not allowed on ' + url.path}
+            return 404, {'error': 'no such endpoint ' + url.path}
+        try:
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise RequestError(400, 'expected a JSON object')
+            query = dict(urllib.parse.parse_qsl(url.query))
+            return 200, await handler(data, query)
+        except RequestError as error:
+            return error.status, {'error': str(error)}
+        except ValueError as error:
+            return 400, {'error': 'invalid JSON: ' + str(error)}
+
+    async def solved(self, cells):
+        """
+        Solves one puzzle in the worker processes, batched with any other puzzles submitted at the same time.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((cells, future))
+        if len(self.pending) == 1:          # First puzzle of this pass schedules the send
+            loop.call_soon(self.flush)
+        solution = await future
+        if solution is None:
+            raise RequestError(422, 'puzzle has no solution')
+        return solution
+
+    def flush(self):
+        """
+        Sends the waiting puzzles to the workers in chunks.
+        """
+        loop = asyncio.get_running_loop()
+        pending, self.pending = self.pending, []
+        for start in range(0, len(pending), self.chunksize):
+            chunk = pending[start:start + self.chunksize]
+            task = loop.run_in_executor(self.executor, solve_many, [cells for cells, future in chunk])
+            task.add_done_callback(functools.partial(self.deliver, chunk))
+
+    def deliver(self, chunk, task):
+        """
+        Hands the solutions of a finished chunk back to the waiting requests.
+        """
+        error = task.exception()
+        for index, (cells, future) in enumerate(chunk):
+            if future.cancelled():
+                continue
+            if error is None:
+                future.set_result(task.result()[index])
+            else:
+                future.set_exception(error)
+
+    def difficulty(self, data, query):
+        """
+        Reads and checks the requested difficulty.
+        """
+        diff = query.get('difficulty', data.get('difficulty', 'easy'))
+        if diff not in prefetch.DIFFICULTIES:
+            raise RequestError(400, 'difficulty must be one of ' + ', '.join(prefetch.DIFFICULTIES))
+        return diff
+
+    async def seeded(self, board_id, day, diff):
+        """
+        Builds a seeded puzzle in the worker processes.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            puzzle, board_id = await loop.run_in_executor(self.executor, seeded_puzzle, board_id, day, diff,
+                                                          self.cache)
+        except ValueError as error:
+            raise RequestError(400, str(error))
+        return {'puzzle': board_text(puzzle), 'difficulty': board_id.split('-')[1], 'id': board_id}
+
+    async def puzzle(self, data, query):
+        """
+        Returns a prepared puzzle of the requested difficulty, or the puzzle for a board ID.
+        """
+        board_id = query.get('id', data.get('id'))
+        if board_id is not None:
+            if not str(board_id).startswith('9-'):
+                raise RequestError(400, 'only 9x9 boards are served')
+            return await self.seeded(str(board_id), None, None)
+        diff = self.difficulty(data, query)
+        puzzle, unsolved, board_id = self.pool.get(diff)
+        return {'puzzle': board_text(puzzle), 'difficulty': diff, 'id': board_id}
+
+    async def daily(self, data, query):
+        """
+        Returns today's puzzle of the requested difficulty.
+        """
+        return await self.seeded(None, datetime.date.today(), self.difficulty(data, query))
+
+    async def solve(self, data, query):
+        """
+        Solves a submitted puzzle.
+        """
+        return {'solution': board_text(await self.solved(read_board(data.get('puzzle'))))}
+
+    async def validate(self, data, query):
+        """
+        Checks a finished board with sudoku.valid_board.
+        """
+        return {'valid': sudoku.valid_board(sudoku.PackedBoard(read_board(data.get('board'))))}
+
+    async def hint(self, data, query):
+        """
+        Reveals the solution of one random empty cell of a board in progress.
+        """
+        cells = read_board(data.get('board'))
+        empty = [cell for cell in range(81) if not cells[cell]]
+        if not empty:
+            raise RequestError(422, 'board is already full')
+        solution = await self.solved(cells)
+        cell = random.choice(empty)
+        return {'row': cell // 9, 'col': cell % 9, 'value': solution[cell]}
+
+    async def batch_solve(self, data, query):
+        """
+        Solves many puzzles at once, split into chunks across the worker processes.
+        """
+        puzzles = data.get('puzzles')
+        if not isinstance(puzzles, list):
+            raise RequestError(400, 'expected a list of puzzles')
+        cells = [read_board(puzzle) for puzzle in puzzles]
+        loop = asyncio.get_running_loop()
+        chunks = [cells[start:start + self.chunksize] for start in range(0, len(cells), self.chunksize)]
+        results = await asyncio.gather(*(loop.run_in_executor(self.executor, solve_many, chunk) for chunk in chunks))
+        return {'solutions': [board_text(solution) if solution else None for result in results for solution in result]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve Sudoku puzzles and solutions over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-j', '--workers', type=int, default=None, help='solver processes (default: all cores)')
+    parser.add_argument('--cache', default=puzzles.CACHE, help='directory for built seeded puzzles')
+    args = parser.parse_args()
+
+    service = PuzzleService(args.workers, cache=puzzles.GameCache(args.cache))
+    print('Serving on http://%s:%d' % (args.host, args.port))
+    try:
+        asyncio.run(service.run(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
@@ -1,214 +1,1270 @@
-# Author: Joseph Caswell
-# Project: Sudoku
-
-import random
-import copy
-
-
-class Board:
-    def __init__(self, diff):
-        """
-        Contains all of the storage and methods for a Sudoku board. Size and difficulty are passed into the function,
-        however currently only 9x9 is supported. The board initialized here is a single solvable and valid board.
-        Manipulating the board in a variety of ways discussed in the init_method results in boards that are
-        unrecognizable compared to this board. There are over 609,499,054,080 possible combinations of boards, just
-        based off this one using the techniques in the init_board method.
-        """
-        self.diff = diff
-        self.board = []
-        self.solved = []
-
-    def difficulty(self):
-        """
-        Initializes board based on given difficulty. A board from a file of pre-created boards is used to select
-        one of desired difficulty.
-        """
-        if self.diff == 'easy':                     # Choose random board of desired difficulty
-            line = random.randint(0, 19)
-        elif self.diff == 'medium':
-            line = random.randint(21, 40)
-        else:
-            line = random.randint(42, 51)
-
-        lst = open('boards.txt', "r").readlines()   # Open the file and format it into self.board
-        raw_board = lst[line].strip()
-        row = []
-        for index in range(81):
-            row.append(int(raw_board[index]))
-            if (index + 1) % 9 == 0:
-                self.board.append(row)
-                row = []
-
-    def shuffle_board(self):
-        """
-        Creates a randomized Sudoku board. Band of 9 numbers columns or rows can be swapped within that quadrant. Band
-        of entire 9 number columns or rows in quadrant can be swapped with other quadrants. Lastly, all numbers of one
-        kind can be replaced with all numbers of another kind, i.e. swapping all 1's and 9's. This yields 9! possible
-        variations. Row and column swapping yields 6^8 variations. Multiplying these two gives 6^8 * 9! or
-        609,499,054,080 possible boards per one solved board. Depending on the difficulty, a board is imported from
-        one of three files.
-        """
-        for swap in range(10000):               # Perform this amount of changes
-            change = random.randint(0, 4)       # Determines randomly which type of swap we will perform
-            if change == 0:                     # Swap two rows (in a 9 * 3 quadrant)
-                row1 = random.randint(0, 8)
-                if row1 % 3 == 0:
-                    row2 = row1 + random.randint(0, 2)
-                elif (row1 + 1) % 3 == 0:
-                    row2 = row1 - random.randint(0, 2)
-                else:
-                    row2 = row1 + random.randint(-1, 1)
-                self.board[row1], self.board[row2] = self.board[row2], self.board[row1]
-
-            elif change == 1:                   # Swap entire column (in a 3 * 9 quadrant)
-                col1 = random.randint(0, 8)
-                if col1 % 3 == 0:
-                    col2 = col1 + random.randint(0, 2)
-                elif (col1 + 1) % 3 == 0:
-                    col2 = col1 - random.randint(0, 2)
-                else:
-                    col2 = col1 + random.randint(-1, 1)
-
-                for row in range(9):
-                    self.board[row][col1], self.board[row][col2] = self.board[row][col2], self.board[row][col1]
-
-            elif change == 2:  # Swap 3 consecutive 9 number rows in one quadrant with another quadrant
-                rows1, rows2 = random.randint(0, 2) * 3, random.randint(0, 2) * 3
-                for row in range(3):
-                    self.board[rows1], self.board[rows2] = self.board[rows2], self.board[rows1]
-                    rows1 += 1
-                    rows2 += 1
-
-            elif change == 3:  # Swap 3 consecutive 9 number columns in one quadrant with another quadrant
-                cols1, cols2 = random.randint(0, 2) * 3, random.randint(0, 2) * 3
-                for col in range(3):
-                    for row in range(9):
-                        self.board[cols1][row], self.board[cols2][row] = self.board[cols2][row], self.board[cols1][row]
-                    cols1 += 1
-                    cols2 += 1
-
-            elif change == 4:  # Swap entire set of two different numbers
-                num1, num2 = random.randint(1, 9), random.randint(1, 9)
-                for row in range(9):
-                    for col in range(9):
-                        if self.board[row][col] == num1:
-                            self.board[row][col] = num2
-                        elif self.board[row][col] == num2:
-                            self.board[row][col] = num1
-
-            self.solved = copy.deepcopy(self.board)     # Create copy of board to use for solver
-
-    def find_empty(self, board):
-        """
-        Finds next empty spot on board.
-        """
-        for row in range(9):
-            for col in range(9):
-                if board[row][col] == 0:
-                    return row, col
-
-        return None
-
-    def valid(self, guess, pos, board):
-        """
-        Checks if given insertion into board is a valid input.
-        """
-        for num in range(9):                # Check row
-            if board[pos[0]][num] == guess and pos[1] != num:
-                return False
-
-        for num in range(9):                # Check column
-            if board[num][pos[1]] == guess and pos[0] != num:
-                return False
-
-        quad_x = pos[1] // 3
-        quad_y = pos[0] // 3
-
-        for row in range(quad_y * 3, quad_y * 3 + 3):     # Check quad/quadrant
-            for col in range(quad_x * 3, quad_x * 3 + 3):
-                if board[row][col] == guess and (row, col) != pos:
-                    return False
-
-        return True
-
-    def solve(self):
-        """
-        Solves the Sudoku board using the backtracking algorithm. This algorithm works by attempting to insert a number
-        1 - 9 in a square. If it is valid we move onto the next square and do the same thing. If we reach a square
-        where no valid number is reachable, we backtrack to the last square and try the other valid numbers. That
-        process is continued until we reach the end of the board with the final solution. Time complexity is O(n^m)
-        where n is board size and m is number of empty cells. (n = 9 in our case).
-        """
-        next_empty = self.find_empty(self.solved)           # Get next empty square
-        if not next_empty:                                  # No empty cells so the board is solved
-            return True
-        else:
-            row, col = next_empty
-        for num in range(1, 10):                            # Attempt to insert numbers 1 - 9
-            if self.valid(num, (row, col), self.solved):    # If valid, insert number
-                self.solved[row][col] = num
-                if self.solve():                            # Keep trying to step forward recursively
-                    return True
-                self.solved[row][col] = 0                   # If board is not valid, remove inserted number
-
-        return False
-
-    def display(self):
-        """
-        Prints the board to the terminal.
-        """
-        for row in self.board:
-            print(row)
-        print("____________")
-        for row in self.solved:
-            print(row)
-
-
-def valid_board(board):
-    """
-    This method is used to cross check the solution the solver comes up with. O(n^2) complexity.
-    """
-    n = 9
-    unique = [False] * (n + 1)          # Store unique values from 1 to n
-
-    for row in range(0, n):             # Traverse each row of the board
-        for m in range(0, n + 1):       # Initialize unique array to false
-            unique[m] = False
-        for col in range(0, n):         # Traverse each column of current row
-            z = board[row][col]         # Store value of board at position
-            if unique[z]:               # Check if current row has duplicate value
-                return False
-            unique[z] = True
-
-    for col in range(0, n):             # Traverse each column of board
-        for m in range(0, n + 1):       # Initialize unique array to false
-            unique[m] = False
-        for row in range(0, n):         # Traverse each row of current column
-            z = board[row][col]         # Store value of board at position
-            if unique[z]:               # Check if current col has duplicate value
-                return False
-            unique[z] = True
-
-    for start in range(0, n - 2, 3):    # Traverse each quadrant of size 3 * 3 on board
-        for col in range(0, n - 2, 3):  # Store first column of each 3 * 3 quadrant
-            for m in range(0, n + 1):
-                unique[m] = False
-
-            # Traverse current block
-            for quad in range(0, 3):    # Traverse current quadrant
-                for row in range(0, 3):
-                    x = start + quad    # Stores row number of current block
-                    y = col + row       # Stores column number of current block
-                    z = board[x][y]     # Store values of board at position
-                    if unique[z]:
-                        return False
-                    unique[z] = True
-    return True
-
-
-if __name__ == "__main__":
-    sudoku = Board('easy')
-    sudoku.difficulty()
-    sudoku.shuffle_board()
-    sudoku.solve()
-    sudoku.display()
+# Author: Joseph Caswell
+# Project: Sudoku
+
+import argparse
+import contextlib
+import cProfile
+import datetime
+import functools
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+import operator
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import puzzles
+
+try:
+    import numpy
+except ImportError:                                 # NumPy is only needed for the batch helpers
+    numpy = None
+
+
+CLUE_SHARE = {                                      # Share of cells given for easy, medium and hard generated boards
+    2: (0.5, 0.4, None),                            # None generates a minimal puzzle
+    4: (0.55, 0.47, 0.42),
+    5: (0.6, 0.55, 0.52),                           # Fewer givens make 25x25 uniqueness checks take minutes
+}
+
+
+class Board:
+    __slots__ = ('diff', 'box', 'seed', 'board', 'solved')
+
+    def __init__(self, diff, box=3, seed=None):
+        """
+        Contains all of the storage and methods for a Sudoku board. Difficulty and box size are passed into the
+        function: box 3 is the standard 9x9 board, and 2, 4 and 5 give 4x4, 16x16 and 25x25 boards. The board
+        initialized here is a single solvable and valid board. Manipulating the board in a variety of ways discussed
+        in the init_method results in boards that are unrecognizable compared to this board. There are over
+        609,499,054,080 possible combinations of boards, just based off this one using the techniques in the
+        init_board method.
+
+        Every random choice is drawn from a random.Random seeded with seed (a new random seed if none is given), so
+        the board ID is enough to build the same puzzle again with from_id. The generator is made by random() when a
+        build starts and passed through its steps rather than kept on the board, where it would take about 2.5 KB.
+        """
+        self.diff = diff if diff in ('easy', 'medium') else 'hard'
+        self.box = box
+        self.seed = random.getrandbits(48) if seed is None else seed
+        self.board = PackedBoard(size=box * box)
+        self.solved = PackedBoard(size=box * box)
+
+    @property
+    def id(self):
+        """
+        Short ID of the board (size, difficulty and seed), for example '9-hard-5c1e0b3f9a2d'.
+        """
+        return '%d-%s-%x' % (self.box * self.box, self.diff, self.seed)
+
+    @classmethod
+    def from_id(cls, board_id, cache=None):
+        """
+        Rebuilds the puzzle and solution named by a board ID by running create() with the same seed. With a
+        puzzles.GameCache, a board built before is read back instead and a new one is stored. Boards from the puzzle
+        file depend on its contents, so IDs stay valid as long as boards.txt does not change.
+        """
+        try:
+            size, diff, seed = board_id.split('-')
+            box, seed = math.isqrt(int(size)), int(seed, 16)
+        except ValueError:
+            raise ValueError('not a board ID: ' + repr(board_id)) from None
+        if box * box != int(size) or box not in (2, 3, 4, 5) or diff not in ('easy', 'medium', 'hard'):
+            raise ValueError('not a board ID: ' + repr(board_id))
+
+        game = cls(diff, box, seed)
+        cached = cache.get(game.id) if cache is not None else None
+        if cached is not None:
+            game.board, game.solved = PackedBoard(cached[0]), PackedBoard(cached[1])
+            return game
+        game.create()
+        if cache is not None:
+            cache.put(game.id, game.board.cells, game.solved.cells)
+        return game
+
+    @classmethod
+    def daily(cls, diff, day=None, box=3, cache=None):
+        """
+        Returns the puzzle of the day for a difficulty and size. The seed is a hash of the date, so every process
+        serves the same puzzle on the same day without sharing any state.
+        """
+        day = day or datetime.date.today()
+        digest = hashlib.sha256(('%s-%d-%s' % (day.isoformat(), box, diff)).encode()).digest()
+        seed = int.from_bytes(digest[:6], 'big')
+        return cls.from_id(cls(diff, box, seed).id, cache)
+
+    def random(self):
+        """
+        Returns a new random.Random seeded with the board's seed. Pass the same one to difficulty() and then
+        shuffle_board() to build the board its ID names.
+        """
+        return random.Random(self.seed)
+
+    def create(self):
+        """
+        Builds a new game the standard way: a board of the chosen difficulty, shuffled, then solved. Returns the board
+        so games can be built in one line.
+        """
+        rng = self.random()
+        self.difficulty(rng)
+        self.shuffle_board(rng=rng)
+        self.solve()
+        return self
+
+    def difficulty(self, rng=None):
+        """
+        Initializes board based on given difficulty. A board from a file of pre-created boards is used to select
+        one of desired difficulty. The file only holds 9x9 boards, so other sizes are generated with a share of
+        givens that falls with the difficulty. rng defaults to a fresh random() of the board.
+        """
+        rng = rng or self.random()
+        if self.box != 3:
+            share = CLUE_SHARE[self.box][('easy', 'medium', 'hard').index(self.diff)]
+            self.generate(None if share is None else int(share * self.box ** 4), rng)
+            return
+        self.board = PackedBoard(puzzles.load().random(self.diff, rng))    # File is parsed once and kept in memory
+
+    def generate(self, clues=None, rng=None):
+        """
+        Initializes the board with a puzzle generated from scratch instead of one from the boards file. The puzzle
+        has a unique solution, which is stored in self.solved, and is minimal unless a clue count is given.
+        """
+        puzzle, solution = generate_puzzle(clues, rng or self.random(), box=self.box)
+        self.board = PackedBoard(puzzle)
+        self.solved = PackedBoard(solution)
+
+    def shuffle_board(self, method='compose', transpose=False, rng=None):
+        """
+        Creates a randomized Sudoku board. Band of 9 numbers columns or rows can be swapped within that quadrant. Band
+        of entire 9 number columns or rows in quadrant can be swapped with other quadrants. Lastly, all numbers of one
+        kind can be replaced with all numbers of another kind, i.e. swapping all 1's and 9's. This yields 9! possible
+        variations. Row and column swapping yields 6^8 variations. Multiplying these two gives 6^8 * 9! or
+        609,499,054,080 possible boards per one solved board. Depending on the difficulty, a board is imported from
+        one of three files.
+
+        The default 'compose' method draws one of these transformations uniformly at random and applies it in a
+        single pass over the board, optionally transposing it as well. The 'swap' method reaches the same
+        transformations through 10,000 random swaps and is kept for comparison. rng defaults to a fresh random() of
+        the board.
+        """
+        rng = rng or self.random()
+        if method == 'swap':
+            self.shuffle_swaps(rng)
+            return
+
+        transform = random_transform(rng, transpose, self.box)
+        self.board = PackedBoard(apply_transform(self.board.cells, transform))
+        self.solved = self.board.copy()                     # Create copy of board to use for solver
+
+    def shuffle_swaps(self, rng=None):
+        """
+        Shuffles the board by performing 10,000 random row, column, band, stack and digit swaps one at a time.
+        """
+        board = self.board.to_rows()
+        box, size, rng = self.box, self.box * self.box, rng or self.random()
+        for swap in range(10000):               # Perform this amount of changes
+            change = rng.randint(0, 4)       # Determines randomly which type of swap we will perform
+            if change == 0:                     # Swap two rows (in a 9 * 3 quadrant)
+                row1 = rng.randint(0, size - 1)
+                if row1 % box == 0:
+                    row2 = row1 + rng.randint(0, box - 1)
+                elif (row1 + 1) % box == 0:
+                    row2 = row1 - rng.randint(0, box - 1)
+                else:
+                    row2 = row1 + rng.randint(-1, 1)
+                board[row1], board[row2] = board[row2], board[row1]
+
+            elif change == 1:                   # Swap entire column (in a 3 * 9 quadrant)
+                col1 = rng.randint(0, size - 1)
+                if col1 % box == 0:
+                    col2 = col1 + rng.randint(0, box - 1)
+                elif (col1 + 1) % box == 0:
+                    col2 = col1 - rng.randint(0, box - 1)
+                else:
+                    col2 = col1 + rng.randint(-1, 1)
+
+                for row in range(size):
+                    board[row][col1], board[row][col2] = board[row][col2], board[row][col1]
+
+            elif change == 2:  # Swap 3 consecutive 9 number rows in one quadrant with another quadrant
+                rows1, rows2 = rng.randint(0, box - 1) * box, rng.randint(0, box - 1) * box
+                for row in range(box):
+                    board[rows1], board[rows2] = board[rows2], board[rows1]
+                    rows1 += 1
+                    rows2 += 1
+
+            elif change == 3:  # Swap 3 consecutive 9 number columns in one quadrant with another quadrant
+                cols1, cols2 = rng.randint(0, box - 1) * box, rng.randint(0, box - 1) * box
+                for col in range(box):
+                    for row in range(size):
+                        board[cols1][row], board[cols2][row] = board[cols2][row], board[cols1][row]
+                    cols1 += 1
+                    cols2 += 1
+
+            elif change == 4:  # Swap entire set of two different numbers
+                num1, num2 = rng.randint(1, size), rng.randint(1, size)
+                for row in range(size):
+                    for col in range(size):
+                        if board[row][col] == num1:
+                            board[row][col] = num2
+                        elif board[row][col] == num2:
+                            board[row][col] = num1
+
+        self.board = PackedBoard.from_rows(board)
+        self.solved = self.board.copy()                 # Create copy of board to use for solver
+
+    def find_empty(self, board):
+        """
+        Finds next empty spot on board.
+        """
+        return find_empty(board)
+
+    def valid(self, guess, pos, board):
+        """
+        Checks if given insertion into board is a valid input.
+        """
+        return valid(guess, pos, board)
+
+    def solve(self, engine='propagate', cache=None, stats=None):
+        """
+        Solves the Sudoku board in place using the chosen engine. The default 'propagate' engine keeps candidate
+        bitmasks for every row, column and box, fills in naked and hidden singles and only guesses on the most
+        constrained cell, which solves any 9x9 board in milliseconds. The original 'backtrack' engine is still
+        available for comparison and for visualizing the algorithm. A cache (canonical.SolutionCache) answers any
+        transform of a puzzle it has already solved without solving it again. Finding the canonical form takes
+        milliseconds, far longer than the propagate engine needs to solve a 9x9 board, so a cache only pays off in
+        front of a slow engine or when repeated puzzles need to be spotted anyway. Passing a SolveStats records how
+        much work the solve took.
+        """
+        if stats is None:
+            return self.run_engine(engine, cache, None)
+        with stats.solving(self.solved.cells, engine):
+            return self.run_engine(engine, cache, stats)
+
+    def run_engine(self, engine, cache, stats):
+        """
+        Runs one solve for Board.solve and writes the solution into self.solved.
+        """
+        if engine == 'backtrack':
+            return self.backtrack(stats)
+
+        if cache is not None:
+            solution = cache.solve(self.solved.cells)
+        else:
+            solution = ENGINES[engine](self.solved.cells, stats=stats)
+        if solution is None:                                # Board has no solution
+            return False
+        self.solved.cells[:] = bytes(solution)
+        return True
+
+    def backtrack(self, stats=None):
+        """
+        Solves the Sudoku board using the backtracking algorithm. This algorithm works by attempting to insert a number
+        1 - 9 in a square. If it is valid we move onto the next square and do the same thing. If we reach a square
+        where no valid number is reachable, we backtrack to the last square and try the other valid numbers. That
+        process is continued until we reach the end of the board with the final solution. Time complexity is O(n^m)
+        where n is board size and m is number of empty cells. (n = 9 in our case). The steps come from
+        backtrack_steps, the same generator the GUI plays back.
+        """
+        for step in backtrack_steps(self.solved, stats):
+            pass
+        return find_empty(self.solved) is None
+
+    def count_solutions(self, limit=2):
+        """
+        Counts the solutions of the puzzle in self.board, stopping once limit solutions are found. A result of 1
+        means the puzzle has exactly one solution.
+        """
+        return count_solutions(self.board.cells, limit)
+
+    def display(self):
+        """
+        Prints the board to the terminal.
+        """
+        for row in self.board:
+            print(list(row))
+        print("____________")
+        for row in self.solved:
+            print(list(row))
+
+
+class SolveStats:
+    """
+    Opt-in record of the work done by one solve: search nodes visited, backtracks (dead ends), the deepest guess,
+    propagation passes, valid/find_empty calls for the backtracking engine and the time spent in each phase. Pass an
+    instance as stats= to Board.solve, backtrack_steps or any engine; without one the solvers skip all counting.
+
+    Hooks are callables hook(stats, event) called with 'start' and 'stop' around the solve, which is where a
+    profiler attaches (see profile_hook). Anything a hook stores in stats.extra is exported with the counters.
+    """
+    __slots__ = ('engine', 'puzzle', 'nodes', 'backtracks', 'max_depth', 'propagations', 'valid_calls',
+                 'find_empty_calls', 'phases', 'hooks', 'extra')
+
+    def __init__(self, hooks=()):
+        self.engine = None
+        self.puzzle = None              # Board as a puzzle line, set when solving starts
+        self.nodes = 0
+        self.backtracks = 0
+        self.max_depth = 0
+        self.propagations = 0
+        self.valid_calls = 0
+        self.find_empty_calls = 0
+        self.phases = {}                # Phase name -> seconds
+        self.hooks = list(hooks)
+        self.extra = {}
+
+    def node(self, depth):
+        """
+        Counts a search node at the given guess depth.
+        """
+        self.nodes += 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def counted(self, fn, name):
+        """
+        Wraps fn so every call adds one to the named counter.
+        """
+        def call(*args):
+            setattr(self, name, getattr(self, name) + 1)
+            return fn(*args)
+        return call
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Adds the time spent inside the with block to the named phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def solving(self, cells, engine):
+        """
+        Wraps one solve: records the puzzle and engine, times the 'solve' phase and runs the hooks around it.
+        """
+        self.puzzle = puzzle_text(cells)
+        self.engine = engine
+        for hook in self.hooks:
+            hook(self, 'start')
+        try:
+            with self.phase('solve'):
+                yield self
+        finally:
+            for hook in reversed(self.hooks):
+                hook(self, 'stop')
+
+    def to_dict(self):
+        """
+        Returns the stats as a plain dictionary, without the hooks.
+        """
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'hooks'}
+
+    def to_json(self):
+        """
+        Returns the stats as one line of JSON.
+        """
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+
+def profile_hook(path=None, sort='cumulative', limit=20):
+    """
+    Returns a SolveStats hook that runs cProfile over the solve. The top limit functions by sort are stored as text
+    in stats.extra['profile'], and the raw profile is also written to path (for pstats or snakeviz) if one is given.
+    """
+    profiler = cProfile.Profile()
+
+    def hook(stats, event):
+        if event == 'start':
+            profiler.enable()
+            return
+        profiler.disable()
+        if path is not None:
+            profiler.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats(sort).print_stats(limit)
+        stats.extra['profile'] = text.getvalue()
+    return hook
+
+
+def find_empty(board):
+    """
+    Finds next empty spot on board.
+    """
+    size = len(board)
+    for row in range(size):
+        for col in range(size):
+            if board[row][col] == 0:
+                return row, col
+
+    return None
+
+
+def valid(guess, pos, board):
+    """
+    Checks if given insertion into board is a valid input.
+    """
+    size = len(board)
+    for num in range(size):             # Check row
+        if board[pos[0]][num] == guess and pos[1] != num:
+            return False
+
+    for num in range(size):             # Check column
+        if board[num][pos[1]] == guess and pos[0] != num:
+            return False
+
+    box = math.isqrt(size)
+    quad_x = pos[1] // box
+    quad_y = pos[0] // box
+
+    for row in range(quad_y * box, quad_y * box + box):     # Check quad/quadrant
+        for col in range(quad_x * box, quad_x * box + box):
+            if board[row][col] == guess and (row, col) != pos:
+                return False
+
+    return True
+
+
+def backtrack_steps(board, stats=None):
+    """
+    Runs the backtracking algorithm on board (indexed board[row][col]) in place and yields every move it makes:
+    ('place', row, col, num) when a number is inserted and ('remove', row, col, num) when it is taken back. The
+    squares being tried are kept on an explicit stack instead of the call stack. When the generator is exhausted
+    the board is either solved or back to where it started if there is no solution. Closing the generator early
+    leaves the board part way through. A SolveStats counts every placement as a node and every removal as a
+    backtrack.
+    """
+    digits = len(board) + 1
+    check, locate = valid, find_empty
+    if stats is not None:
+        check, locate = stats.counted(valid, 'valid_calls'), stats.counted(find_empty, 'find_empty_calls')
+    stack = []                                  # Squares filled so far, with the number they hold
+    pos = locate(board)
+    start = 1
+    while pos is not None:
+        row, col = pos
+        for num in range(start, digits):        # Attempt to insert numbers start - 9
+            if check(num, pos, board):
+                board[row][col] = num
+                yield 'place', row, col, num
+                stack.append((row, col, num))
+                if stats is not None:
+                    stats.node(len(stack))
+                pos = locate(board)
+                start = 1
+                break
+        else:                                   # Nothing fits, take back the last number and try the next one
+            if not stack:
+                return
+            row, col, num = stack.pop()
+            board[row][col] = 0
+            if stats is not None:
+                stats.backtracks += 1
+            yield 'remove', row, col, num
+            pos = (row, col)
+            start = num + 1
+
+
+class PackedBoard:
+    """
+    Compact board stored as a flat bytearray of cell values (81 of them on a 9x9 board), row by row. Indexing with a
+    row number returns a writable memoryview of that row, so board[row][col] reads and assigns exactly like the
+    nested lists it replaces. Column and box views are just as cheap, copying is a single bytearray copy and
+    to_rows/from_rows convert to and from the nested list form. An empty board of another size is made with
+    PackedBoard(size=16).
+    """
+    __slots__ = ('cells', 'size')
+
+    def __init__(self, cells=None, size=9):
+        self.cells = bytearray(cells) if cells is not None else bytearray(size * size)
+        self.size = math.isqrt(len(self.cells))
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a packed board from a nested board.
+        """
+        return cls(flatten(rows))
+
+    def to_rows(self):
+        """
+        Returns the board as nested lists.
+        """
+        return unflatten(self.cells)
+
+    def __getitem__(self, row):
+        size = self.size
+        return memoryview(self.cells)[row * size:row * size + size]
+
+    def __iter__(self):
+        view = memoryview(self.cells)
+        size = self.size
+        for start in range(0, size * size, size):
+            yield view[start:start + size]
+
+    def __len__(self):
+        return self.size
+
+    def __eq__(self, other):
+        return isinstance(other, PackedBoard) and self.cells == other.cells
+
+    def __repr__(self):
+        return 'PackedBoard(' + repr(bytes(self.cells)) + ')'
+
+    def row(self, row):
+        """
+        Writable view of one row.
+        """
+        return self[row]
+
+    def col(self, col):
+        """
+        Writable view of one column.
+        """
+        return memoryview(self.cells)[col::self.size]
+
+    def box(self, box):
+        """
+        Values of one box, boxes numbered 0 - 8 row by row on a 9x9 board.
+        """
+        size = self.size
+        width = math.isqrt(size)
+        start = (box // width) * width * size + (box % width) * width
+        cells = self.cells
+        return b''.join(cells[row:row + width] for row in range(start, start + width * size, size))
+
+    def copy(self):
+        """
+        Returns an independent copy of the board.
+        """
+        return PackedBoard(self.cells)
+
+
+def valid_board(board):
+    """
+    This method is used to cross check the solution the solver comes up with. A board is valid when every row,
+    column and box holds the digits 1 - 9 (1 - N on an NxN board) exactly once. Each unit is read with a
+    precomputed itemgetter and compared as a set, and NumPy arrays are handed to the vectorized valid_boards.
+    """
+    if numpy is not None and isinstance(board, numpy.ndarray):
+        return bool(valid_boards(board.reshape(1, -1))[0])
+    cells = board.cells if isinstance(board, PackedBoard) else flatten(board)
+    shape = board_geometry(len(cells))
+    digits = shape.digits
+    for unit in shape.unit_getters:
+        if set(unit(cells)) != digits:
+            return False
+    return True
+
+
+def valid_boards(boards, chunk=65536):
+    """
+    Validates a whole batch of boards at once. boards is anything NumPy can view as an (N, 9, 9) or (N, 81) integer
+    array (or the same for another board size), and the result is a boolean array with one entry per board. Each
+    cell becomes the bit 1 << value and the bits are OR-reduced along rows, columns and boxes (a reshaped view of the
+    same array), so a unit is valid exactly when its mask has bits 1 - 9 set. Boards are processed chunk at a time
+    to bound temporary memory.
+    """
+    if numpy is None:
+        raise ImportError('valid_boards requires NumPy')
+    boards = numpy.asarray(boards)
+    shape = board_geometry(boards.shape[-1] * (boards.shape[-1] if boards.ndim == 3 else 1))
+    size, box = shape.size, shape.box
+    boards = boards.reshape(-1, size, size)
+    mask = numpy.int16 if size < 15 else numpy.int32
+    result = numpy.empty(len(boards), dtype=bool)
+    for start in range(0, len(boards), chunk):
+        part = boards[start:start + chunk]
+        count = len(part)
+        in_range = ((part >= 1) & (part <= size)).all(axis=(1, 2))
+        bits = numpy.left_shift(mask(1), numpy.clip(part, 0, size).astype(mask))
+        boxes = bits.reshape(count, box, box, box, box).transpose(0, 1, 3, 2, 4).reshape(count, size, size)
+        rows_ok = (numpy.bitwise_or.reduce(bits, axis=2) == shape.full_unit).all(axis=1)
+        cols_ok = (numpy.bitwise_or.reduce(bits, axis=1) == shape.full_unit).all(axis=1)
+        boxes_ok = (numpy.bitwise_or.reduce(boxes, axis=2) == shape.full_unit).all(axis=1)
+        result[start:start + count] = in_range & rows_ok & cols_ok & boxes_ok
+    return result
+
+
+class Geometry:
+    """
+    Lookup tables for the bitmask solver on a board of box x box boxes, which has size = box * box rows, columns,
+    boxes and digits. Cells are indexed row by row, digit d is stored as the bit 1 << (d - 1) and the units are
+    numbered rows first, then columns, then boxes. Use geometry() rather than building these directly, so each size
+    is only built once.
+    """
+    __slots__ = ('box', 'size', 'cells', 'all_digits', 'bit_count', 'bit_digit', 'cell_units', 'units', 'peers',
+                 'unit_getters', 'digits', 'full_unit')
+
+    def __init__(self, box):
+        size = box * box
+        cells = size * size
+        self.box = box
+        self.size = size
+        self.cells = cells
+        self.all_digits = (1 << size) - 1
+        self.bit_count = bit_counts(size)
+        self.bit_digit = {1 << (digit - 1): digit for digit in range(1, size + 1)}
+        self.cell_units = tuple((cell // size, size + cell % size,
+                                 2 * size + (cell // (size * box)) * box + (cell % size) // box)
+                                for cell in range(cells))
+        units = [[] for unit in range(3 * size)]
+        for cell, cell_units in enumerate(self.cell_units):
+            for unit in cell_units:
+                units[unit].append(cell)
+        self.units = tuple(tuple(members) for members in units)
+        self.peers = tuple(tuple(sorted(set(peer for unit in self.cell_units[cell] for peer in self.units[unit])
+                                        - {cell}))
+                           for cell in range(cells))
+        self.unit_getters = tuple(operator.itemgetter(*members) for members in self.units)
+        self.digits = frozenset(range(1, size + 1))
+        self.full_unit = self.all_digits << 1       # Bits 1 - size, as used by valid_boards
+
+
+def bit_counts(bits):
+    """
+    Returns a table of the number of set bits in every mask below 1 << bits. Up to 16 bits it is a tuple, the
+    fastest thing to index. The 25x25 table would not fit in memory as a tuple, so it is kept as bytes instead,
+    doubled one bit at a time with bytes.translate so even its 32 MB take a fraction of a second to build.
+    """
+    if bits <= 16:
+        return tuple(bin(mask).count('1') for mask in range(1 << bits))
+    plus_one = bytes(range(1, 256)) + b'\x00'
+    table = b'\x00'
+    for bit in range(bits):
+        table += table.translate(plus_one)
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def geometry(box=3):
+    """
+    Returns the shared Geometry for boards of box x box boxes (3 for the standard 9x9 board).
+    """
+    if not 2 <= box <= 5:
+        raise ValueError('box size must be between 2 and 5')
+    return Geometry(box)
+
+
+@functools.lru_cache(maxsize=None)
+def board_geometry(count):
+    """
+    Returns the Geometry of a flat board with count cells.
+    """
+    box = math.isqrt(math.isqrt(count))
+    if box ** 4 != count:
+        raise ValueError(str(count) + ' cells is not a square board of square boxes')
+    return geometry(box)
+
+
+NINE = geometry(3)
+ALL_DIGITS = NINE.all_digits                        # The standard 9x9 tables, used throughout
+BIT_COUNT = NINE.bit_count
+BIT_DIGIT = NINE.bit_digit
+CELL_UNITS = NINE.cell_units
+UNITS = NINE.units
+PEERS = NINE.peers                                  # The 20 other cells sharing a row, column or box
+UNIT_GETTERS = NINE.unit_getters
+DIGITS = NINE.digits
+FULL_UNIT = NINE.full_unit
+
+
+def flatten(board):
+    """
+    Converts a nested board into a flat list of values, row by row.
+    """
+    return [value for row in board for value in row]
+
+
+def unflatten(cells):
+    """
+    Converts a flat list of values (81 for a 9x9 board) back into a nested board.
+    """
+    size = math.isqrt(len(cells))
+    return [list(cells[row * size:row * size + size]) for row in range(size)]
+
+
+def random_transform(rng=None, transpose=False, box=3):
+    """
+    Draws a random element of the Sudoku symmetry group: an order for the three bands and the rows inside each band,
+    an order for the three stacks and the columns inside each stack, a relabelling of the digits and, if transpose
+    is True, a coin flip on transposing the board. Returns (rows, cols, digits, transposed) where rows and cols give
+    the source row and column for each position and digits maps every old value to its new one (0 stays 0). box
+    picks the board size, with box bands and stacks of box rows and columns each.
+    """
+    rng = rng or random
+    rows = [band * box + row for band in rng.sample(range(box), box) for row in rng.sample(range(box), box)]
+    cols = [stack * box + col for stack in rng.sample(range(box), box) for col in rng.sample(range(box), box)]
+    digits = [0] + rng.sample(range(1, box * box + 1), box * box)
+    transposed = transpose and rng.random() < 0.5
+    return rows, cols, digits, transposed
+
+
+def apply_transform(cells, transform):
+    """
+    Applies a transform from random_transform to a flat board in a single pass and returns the new flat board. The
+    board is transposed first (if requested), then rows and columns are reordered and digits relabelled.
+    """
+    rows, cols, digits, transposed = transform
+    size = len(rows)
+    if transposed:
+        return [digits[cells[col * size + row]] for row in rows for col in cols]
+    return [digits[cells[row * size + col]] for row in rows for col in cols]
+
+
+def propagate(cells, used, shape=NINE):
+    """
+    Fills in naked singles (cells with one candidate left) and hidden singles (digits with one place left in a unit)
+    until neither applies. Returns the empty cell with the fewest candidates, -1 if the board is full, or None if
+    the board reached a contradiction. shape is the Geometry of the board.
+    """
+    all_digits, bit_count, bit_digit, cell_units = shape.all_digits, shape.bit_count, shape.bit_digit, shape.cell_units
+    while True:
+        progress = False
+        best, best_count = -1, shape.size + 1
+        for cell in range(shape.cells):             # Naked singles, remembering the most constrained cell
+            if cells[cell]:
+                continue
+            row, col, box = cell_units[cell]
+            cand = all_digits & ~(used[row] | used[col] | used[box])
+            count = bit_count[cand]
+            if count == 1:
+                cells[cell] = bit_digit[cand]
+                used[row] |= cand
+                used[col] |= cand
+                used[box] |= cand
+                progress = True
+            elif count == 0:
+                return None
+            elif count < best_count:
+                best, best_count = cell, count
+        if progress:
+            continue
+
+        for unit, members in enumerate(shape.units):    # Hidden singles
+            once = twice = 0
+            for cell in members:
+                if not cells[cell]:
+                    row, col, box = cell_units[cell]
+                    cand = all_digits & ~(used[row] | used[col] | used[box])
+                    twice |= once & cand
+                    once |= cand
+            if (once | used[unit]) != all_digits:   # Some digit has nowhere left to go
+                return None
+            once &= ~twice
+            if not once:
+                continue
+            for cell in members:
+                if not cells[cell]:
+                    row, col, box = cell_units[cell]
+                    cand = all_digits & ~(used[row] | used[col] | used[box]) & once
+                    if cand & (cand - 1):           # Two digits can only go in this one cell
+                        return None
+                    if cand:
+                        cells[cell] = bit_digit[cand]
+                        used[row] |= cand
+                        used[col] |= cand
+                        used[box] |= cand
+                        progress = True
+        if not progress:
+            return best
+
+
+def search(cells, used, rng=None, stats=None, depth=0, shape=NINE):
+    """
+    Depth first search over the most constrained cell, propagating singles after every guess. Yields each solution
+    as a flat list. Digits are tried in increasing order unless a random.Random instance is given to shuffle them.
+    """
+    if stats is not None:
+        stats.node(depth)
+        stats.propagations += 1
+    cell = propagate(cells, used, shape)
+    if cell is None:
+        if stats is not None:
+            stats.backtracks += 1
+        return
+    if cell < 0:
+        yield cells
+        return
+
+    row, col, box = shape.cell_units[cell]
+    cand = shape.all_digits & ~(used[row] | used[col] | used[box])
+    bits = [bit for bit in shape.bit_digit if cand & bit]
+    if rng is not None:
+        rng.shuffle(bits)
+    for bit in bits:                                # Each branch works on its own copy of the state
+        next_cells, next_used = cells[:], used[:]
+        next_cells[cell] = shape.bit_digit[bit]
+        next_used[row] |= bit
+        next_used[col] |= bit
+        next_used[box] |= bit
+        yield from search(next_cells, next_used, rng, stats, depth + 1, shape)
+
+
+def unit_masks(cells):
+    """
+    Returns the bitmask of digits already used in each unit (27 of them on a 9x9 board), or None if a digit is
+    repeated in a row, column or box.
+    """
+    shape = board_geometry(len(cells))
+    used = [0] * (3 * shape.size)
+    cell_units = shape.cell_units
+    for cell, value in enumerate(cells):
+        if value:
+            bit = 1 << (value - 1)
+            for unit in cell_units[cell]:
+                if used[unit] & bit:
+                    return None
+                used[unit] |= bit
+    return used
+
+
+def propagate_solutions(cells, rng=None, stats=None):
+    """
+    Yields every solution of a flat board (0 for empty) found by the constraint propagation engine. Boards whose
+    givens already clash have no solutions. Any board size works, from 4x4 up to 25x25.
+    """
+    used = unit_masks(cells)
+    if used is not None:
+        yield from search(list(cells), used, rng, stats, 0, board_geometry(len(cells)))
+
+
+def solve_propagate(cells, rng=None, stats=None):
+    """
+    Returns the first solution of a flat board as a list, or None if there is none.
+    """
+    return next(propagate_solutions(cells, rng, stats), None)
+
+
+class ExactCover:
+    """
+    Dancing Links (Algorithm X) solver for a board encoded as an exact cover problem. Every (cell, digit) choice is a
+    row of the matrix covering four columns: the cell itself and the digit in its row, column and box. Only choices
+    that agree with the givens are added, and columns already satisfied by a given are left out, so the search
+    starts from the reduced matrix. The links are stored in flat lists rather than node objects. The search leaves
+    the links however it stopped, so build a new instance for every board.
+    """
+    def __init__(self, cells, stats=None):
+        self.cells = list(cells)
+        self.stats = stats                          # Optional SolveStats counting nodes and dead ends
+        used = unit_masks(self.cells)
+        self.valid = used is not None               # Givens must not repeat a digit
+        if not self.valid:
+            return
+
+        shape = board_geometry(len(self.cells))
+        count, size = shape.cells, shape.size
+        columns = {}                                # Constraint key -> column header node
+        self.left, self.right, self.up, self.down = [0], [0], [0], [0]
+        self.column, self.size, self.choice = [0], [0], [None]
+        for cell in range(count):
+            if self.cells[cell]:
+                continue
+            row, col, box = shape.cell_units[cell]
+            for digit in range(1, size + 1):
+                bit = 1 << (digit - 1)
+                if (used[row] | used[col] | used[box]) & bit:
+                    continue
+                keys = (cell, count + row * size + digit, 2 * count + (col - size) * size + digit,
+                        3 * count + (box - 2 * size) * size + digit)
+                first = None
+                for key in keys:
+                    if key not in columns:
+                        columns[key] = self.add_header()
+                    node = self.add_node(columns[key], (cell, digit))
+                    if first is None:
+                        first = node
+                    else:                           # Link into the row's circular list
+                        self.left[node], self.right[node] = self.left[first], first
+                        self.right[self.left[first]] = node
+                        self.left[first] = node
+
+        # Every constraint not satisfied by a given needs at least one candidate to cover it
+        needed = sum(1 for cell in self.cells if not cell) * 4
+        if len(columns) != needed:
+            self.valid = False
+
+    def add_header(self):
+        """
+        Appends a column header to the right end of the header list.
+        """
+        node = len(self.left)
+        self.left.append(self.left[0])
+        self.right.append(0)
+        self.right[self.left[0]] = node
+        self.left[0] = node
+        self.up.append(node)
+        self.down.append(node)
+        self.column.append(node)
+        self.size.append(0)
+        self.choice.append(None)
+        return node
+
+    def add_node(self, header, choice):
+        """
+        Appends a node to the bottom of a column. Its row links point to itself until it is joined to a row.
+        """
+        node = len(self.left)
+        self.left.append(node)
+        self.right.append(node)
+        self.up.append(self.up[header])
+        self.down.append(header)
+        self.down[self.up[header]] = node
+        self.up[header] = node
+        self.column.append(header)
+        self.size.append(0)
+        self.choice.append(choice)
+        self.size[header] += 1
+        return node
+
+    def cover(self, header):
+        """
+        Removes a column and every row that intersects it.
+        """
+        left, right, up, down, column, size = self.left, self.right, self.up, self.down, self.column, self.size
+        right[left[header]] = right[header]
+        left[right[header]] = left[header]
+        node = down[header]
+        while node != header:
+            other = right[node]
+            while other != node:
+                down[up[other]] = down[other]
+                up[down[other]] = up[other]
+                size[column[other]] -= 1
+                other = right[other]
+            node = down[node]
+
+    def uncover(self, header):
+        """
+        Restores a column removed by cover, undoing the removals in reverse order.
+        """
+        left, right, up, down, column, size = self.left, self.right, self.up, self.down, self.column, self.size
+        node = up[header]
+        while node != header:
+            other = left[node]
+            while other != node:
+                size[column[other]] += 1
+                down[up[other]] = other
+                up[down[other]] = other
+                other = left[other]
+            node = up[node]
+        right[left[header]] = header
+        left[right[header]] = header
+
+    def search(self, chosen):
+        """
+        Algorithm X: cover the column with the fewest rows, try each of its rows and recurse on what is left.
+        """
+        right, down, size = self.right, self.down, self.size
+        if self.stats is not None:
+            self.stats.node(len(chosen))
+        if right[0] == 0:                           # Every constraint is covered
+            yield chosen
+            return
+
+        header, best = 0, len(self.left)
+        node = right[0]
+        while node != 0:                            # Column with the fewest remaining rows
+            if size[node] < best:
+                header, best = node, size[node]
+                if best < 2:
+                    break
+            node = right[node]
+        if best == 0:
+            if self.stats is not None:
+                self.stats.backtracks += 1
+            return
+
+        self.cover(header)
+        node = down[header]
+        while node != header:
+            chosen.append(self.choice[node])
+            other = right[node]
+            while other != node:
+                self.cover(self.column[other])
+                other = right[other]
+            yield from self.search(chosen)
+            other = self.left[node]
+            while other != node:
+                self.uncover(self.column[other])
+                other = self.left[other]
+            chosen.pop()
+            node = down[node]
+        self.uncover(header)
+
+    def solutions(self, limit=None):
+        """
+        Yields up to limit solutions (all of them if limit is None) as flat lists of cell values.
+        """
+        if not self.valid:
+            return
+        found = 0
+        for chosen in self.search([]):
+            solution = self.cells[:]
+            for cell, digit in chosen:
+                solution[cell] = digit
+            yield solution
+            found += 1
+            if limit is not None and found >= limit:
+                return
+
+
+def solve_dlx(cells, stats=None):
+    """
+    Returns the first solution of a flat board found with Dancing Links, or None if there is none.
+    """
+    return next(ExactCover(cells, stats).solutions(1), None)
+
+
+def count_solutions(cells, limit=2):
+    """
+    Counts the solutions of a flat board, stopping as soon as limit is reached. With the default limit of 2
+    a result of 1 means the puzzle is unique.
+    """
+    return sum(1 for _ in ExactCover(cells).solutions(limit))
+
+
+def random_grid(rng=None, box=3):
+    """
+    Builds a random completely filled board by running the propagation engine on an empty board with the digit
+    order shuffled at every guess.
+    """
+    return solve_propagate([0] * geometry(box).cells, rng or random.Random())
+
+
+def unique_without(puzzle, cell, value):
+    """
+    Checks that a puzzle with a unique solution stays unique after the given at cell (holding value) is removed.
+    Any second solution must put a different digit in that cell, so it is enough to show none of them can be
+    completed, and each attempt stops at its first solution.
+    """
+    shape = board_geometry(len(puzzle))
+    used = unit_masks(puzzle)
+    row, col, box = shape.cell_units[cell]
+    cand = shape.all_digits & ~(used[row] | used[col] | used[box]) & ~(1 << (value - 1))
+    for bit in shape.bit_digit:
+        if cand & bit:
+            cells, masks = list(puzzle), used[:]
+            cells[cell] = shape.bit_digit[bit]
+            masks[row] |= bit
+            masks[col] |= bit
+            masks[box] |= bit
+            if next(search(cells, masks, shape=shape), None) is not None:
+                return False
+    return True
+
+
+def generate_puzzle(clues=None, rng=None, accept=None, box=3, keep=None):
+    """
+    Generates a new puzzle from scratch and returns it with its solution as flat lists of cell values. A random full
+    board is built first, then givens are removed one at a time in random order, keeping a removal only if the
+    solution stays unique and keep (an optional test run on the puzzle after every such removal) returns True.
+    Generation stops once the puzzle is down to clues givens, once accept (an optional test run on the puzzle after
+    every removal, for example a rating check) returns True, or when no given can be removed, which leaves a minimal
+    puzzle. box picks the board size (2 for 4x4, 4 for 16x16, 5 for 25x25).
+    """
+    rng = rng or random.Random()
+    solution = random_grid(rng, box)
+    puzzle = solution[:]
+    remaining = len(puzzle)
+    order = list(range(remaining))
+    rng.shuffle(order)
+    for cell in order:
+        if clues is not None and remaining <= clues:
+            break
+        value = puzzle[cell]
+        puzzle[cell] = 0
+        if not unique_without(puzzle, cell, value):     # Removal allows a second solution, put it back
+            puzzle[cell] = value
+            continue
+        if keep is not None and not keep(puzzle):
+            puzzle[cell] = value
+            continue
+        remaining -= 1
+        if accept is not None and accept(puzzle):
+            break
+    return puzzle, solution
+
+
+SYMBOLS = '0123456789ABCDEFGHIJKLMNOP'               # Cell value -> character in puzzle lines
+PUZZLE_SIZES = {box ** 4: box * box for box in (2, 3, 4, 5)}   # Puzzle line length -> largest digit
+
+ENGINES = {                                         # Solver engines selectable through Board.solve
+    'propagate': solve_propagate,
+    'dlx': solve_dlx,
+}
+
+
+def parse_puzzle(line):
+    """
+    Returns the cell values of a puzzle line ('0' or '.' for empty cells), or None if the line is not a puzzle.
+    Lines of 81 characters are 9x9 boards; 16, 256 and 625 characters are 4x4, 16x16 and 25x25 boards, which write
+    10 - 25 as the letters A - P.
+    """
+    line = line.strip()
+    if len(line) not in PUZZLE_SIZES:
+        return None
+    cells = line.encode().translate(puzzles.CELL_VALUES)
+    return cells if max(cells) <= PUZZLE_SIZES[len(line)] else None
+
+
+def puzzle_text(cells):
+    """
+    Writes cell values as a puzzle line, the reverse of parse_puzzle.
+    """
+    return ''.join(SYMBOLS[value] for value in cells)
+
+
+def solve_lines(chunk, engine='propagate', record=False):
+    """
+    Solves a chunk of (line number, puzzle) pairs and returns (line number, solution, stats) triples, with the
+    solution written as a puzzle line or 'unsolvable'. stats is the solve's SolveStats as JSON when record is
+    set and None otherwise. Used by the batch solver workers.
+    """
+    if engine == 'batch':
+        return batch_lines(chunk)
+    solve = ENGINES[engine]
+    results = []
+    for number, cells in chunk:
+        stats = None
+        if record:
+            stats = SolveStats()
+            with stats.solving(cells, engine):
+                solution = solve(cells, stats=stats)
+        else:
+            solution = solve(cells)
+        results.append((number, puzzle_text(solution) if solution else 'unsolvable',
+                        stats and stats.to_json()))
+    return results
+
+
+def batch_lines(chunk):
+    """
+    solve_lines for the 'batch' engine: the 9x9 puzzles of the chunk are solved together by batch.solve and any
+    other size one at a time. No stats are recorded.
+    """
+    import batch                                    # Needs NumPy, so only loaded for this engine
+    solutions, solved = batch.solve(numpy.frombuffer(b''.join(cells for number, cells in chunk if len(cells) == 81),
+                                                     dtype=numpy.uint8))
+    found = zip(solutions.tolist(), solved)
+    results = []
+    for number, cells in chunk:
+        if len(cells) == 81:
+            solution, ok = next(found)
+            solution = solution if ok else None
+        else:
+            solution = solve_propagate(cells)
+        results.append((number, puzzle_text(solution) if solution else 'unsolvable', None))
+    return results
+
+
+def read_chunks(lines, size, slots):
+    """
+    Groups the puzzle lines of a stream into chunks of (line number, cells) pairs. Each chunk takes one of the slots
+    before it is handed out, so only a bounded number of chunks are ever waiting in memory.
+    """
+    chunk = []
+    for number, line in enumerate(lines, 1):
+        cells = parse_puzzle(line)
+        if cells is None:                               # Skip section markers and blank lines
+            continue
+        chunk.append((number, cells))
+        if len(chunk) == size:
+            slots.acquire()
+            yield chunk
+            chunk = []
+    if chunk:
+        slots.acquire()
+        yield chunk
+
+
+def solve_stream(lines, output, jobs=None, chunksize=256, ordered=True, engine='propagate', stats=None):
+    """
+    Solves every puzzle line read from lines and writes the solutions to output, fanning chunks of puzzles out to a
+    pool of jobs worker processes. Solutions are written in input order, or as soon as each chunk completes
+    (prefixed with the input line number) when ordered is False. If stats is a file, the SolveStats of every puzzle
+    are written to it as JSON lines. Returns the number of puzzles solved.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    slots = threading.Semaphore(jobs * 4)               # Chunks read ahead of the writer
+    chunks = read_chunks(lines, chunksize, slots)
+    solve = functools.partial(solve_lines, engine=engine, record=stats is not None)
+    count = 0
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        if pool is None:
+            results = map(solve, chunks)
+        elif ordered:
+            results = pool.imap(solve, chunks)
+        else:
+            results = pool.imap_unordered(solve, chunks)
+        for result in results:
+            if ordered:
+                output.write(''.join(solution + '\n' for number, solution, record in result))
+            else:
+                output.write(''.join(str(number) + ' ' + solution + '\n' for number, solution, record in result))
+            if stats is not None:
+                stats.write(''.join(record + '\n' for number, solution, record in result))
+            count += len(result)
+            slots.release()
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return count
+
+
+def main(argv=None):
+    """
+    Command line entry point. With no command a random easy board is solved and printed, 'solve' batch solves a file
+    of puzzles.
+    """
+    parser = argparse.ArgumentParser(prog='python -m sudoku', description='Sudoku board tools.')
+    commands = parser.add_subparsers(dest='command')
+    solver = commands.add_parser('solve', help='solve a file of puzzle lines (81 characters for 9x9 boards)')
+    solver.add_argument('input', nargs='?', default='-', help='puzzle file, - for stdin (default)')
+    solver.add_argument('-o', '--output', default='-', help='solution file, - for stdout (default)')
+    solver.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    solver.add_argument('-c', '--chunksize', type=int, default=256, help='puzzles sent to a worker at a time')
+    solver.add_argument('-u', '--unordered', action='store_true', help='write solutions as they complete')
+    engines = sorted(ENGINES) + (['batch'] if numpy is not None else [])
+    solver.add_argument('-e', '--engine', choices=engines, default='propagate',
+                        help="'batch' solves each chunk of 9x9 puzzles together with NumPy (try -c 4096)")
+    solver.add_argument('-s', '--stats', help='also write the solve stats of every puzzle to this file as JSON lines')
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        sudoku = Board('easy')
+        sudoku.create()
+        sudoku.display()
+        return
+
+    if args.engine == 'batch' and args.stats:
+        parser.error('the batch engine does not record stats')
+    source = sys.stdin if args.input == '-' else open(args.input)
+    target = sys.stdout if args.output == '-' else open(args.output, 'w')
+    stats = open(args.stats, 'w') if args.stats else None
+    start = time.perf_counter()
+    try:
+        count = solve_stream(source, target, args.jobs, args.chunksize, not args.unordered, args.engine, stats)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+        if stats is not None:
+            stats.close()
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed else 0
+    print('Solved %d puzzles in %.2f s (%.0f puzzles/s)' % (count, elapsed, rate), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()